@@ -0,0 +1,146 @@
+# Imports
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+
+# Set variables and flags
+# Rows are generated and written CHUNK_ROWS at a time so memory use does not grow with the requested size
+CHUNK_ROWS = 100000
+START_DATE = '2025-08-01'
+DAYS = 31
+CURRENCIES = ['USD', 'EUR', 'GBP', 'ZAR']
+UNKNOWN_CURRENCIES = ['XXX', 'USDEUR']
+PAYMENT_METHODS = ['card', 'cash', 'wallet', 'bank_transfer']
+STORE_IDS = ['CT-01', 'CT-02', 'CT-03', 'CT-04', 'CT-05']
+PARTNER = 'ACME-PARTNER'
+JSON_NAME = 'transactions_online.json'
+CSV_NAME = 'transactions_storeA.csv'
+XML_NAME = 'transactions_partner.xml'
+
+# Share of rows generated with each kind of dirty value found in the sample data
+DIRTY_RATES = {
+    'null_customer': 0.02,
+    'invalid_date': 0.01,
+    'swapped_timestamp': 0.02,
+    'bad_amount': 0.02,
+    'unknown_currency': 0.01,
+}
+
+# Exchange rates used instead of the frankfurter API when processing generated data
+FIXED_RATES = {'EUR': 0.853, 'GBP': 0.744, 'ZAR': 17.29}
+
+
+# This function generates the column values shared by every source for count rows
+# and returns them as a dictionary of pandas series
+def generate_columns(rng, count, dirty):
+    customer = pd.Series(rng.integers(1000, 100000, count), dtype='Int64')
+    customer[rng.random(count) < dirty['null_customer']] = pd.NA
+    amount = np.round(rng.lognormal(3, 1.2, count), 2)
+    bad_amount = rng.random(count) < dirty['bad_amount']
+    amount[bad_amount] = -np.floor(rng.random(bad_amount.sum()) * 10)
+    currency = rng.choice(CURRENCIES, count).astype(object)
+    unknown = rng.random(count) < dirty['unknown_currency']
+    currency[unknown] = rng.choice(UNKNOWN_CURRENCIES, unknown.sum())
+    when = np.datetime_as_string(np.datetime64(START_DATE, 's') + rng.integers(0, DAYS * 24 * 60 * 60, count), unit='s')
+    return {
+        'customer': customer,
+        'amount': pd.Series(amount),
+        'currency': pd.Series(currency),
+        'date': pd.Series(when).str[:10],
+        'time': pd.Series(when).str[11:],
+        'invalid_date': rng.random(count) < dirty['invalid_date'],
+        'swapped': rng.random(count) < dirty['swapped_timestamp'],
+        'payment_method': pd.Series(rng.choice(PAYMENT_METHODS, count)),
+    }
+
+# This function replaces the rendered timestamps of dirty rows with swapped time and date or an invalid value
+def dirty_timestamps(timestamps, columns):
+    timestamps = timestamps.where(~columns['swapped'], columns['time'] + ' ' + columns['date'])
+    return timestamps.where(~columns['invalid_date'], 'INVALID_DATE')
+
+# This function renders a chunk of rows in the layout of the online JSON source
+# and returns one JSON record string per row
+def json_records(columns, ids):
+    customer = ('"C-' + columns['customer'].astype('string') + '"').fillna('null').astype(object)
+    occurred_at = dirty_timestamps(columns['date'] + 'T' + columns['time'] + 'Z', columns)
+    return ('{"id": "ON-' + ids + '", "channel": "online", "customer": {"id": ' + customer
+            + ', "email": "customer' + ids + '@example.com"}, "total": {"amount": ' + columns['amount'].astype(str)
+            + ', "currency": "' + columns['currency'] + '"}, "occurred_at": "' + occurred_at
+            + '", "payment": {"method": "' + columns['payment_method'] + '"}, "meta": {}}')
+
+# This function renders a chunk of rows in the layout of the store CSV source
+# and returns them as a dataframe with the CSV columns
+def csv_frame(columns, ids, rng):
+    return pd.DataFrame({
+        'transaction_id': 'S-A-' + ids,
+        'source': 'store',
+        'customer_id': columns['customer'],
+        'amount': columns['amount'],
+        'currency': columns['currency'],
+        'timestamp': dirty_timestamps(columns['date'] + 'T' + columns['time'] + '+02:00', columns),
+        'payment_method': columns['payment_method'],
+        'store_id': rng.choice(STORE_IDS, len(ids)),
+    })
+
+# This function renders a chunk of rows in the layout of the partner XML source
+# and returns one Transaction element string per row
+# Like the sample data, half of the timestamps use a space instead of the ISO 8601 layout
+def xml_elements(columns, ids, rng):
+    customer = columns['customer'].astype('string').fillna('').astype(object)
+    iso = rng.random(len(ids)) < 0.5
+    when = (columns['date'] + 'T' + columns['time'] + 'Z').where(iso, columns['date'] + ' ' + columns['time'])
+    return ('  <Transaction id="PT-' + ids + '">\n    <Customer id="' + customer + '"/>\n    <Amount currency="'
+            + columns['currency'] + '">' + columns['amount'].astype(str) + '</Amount>\n    <When>'
+            + dirty_timestamps(when, columns) + '</When>\n    <Payment method="' + columns['payment_method']
+            + '"/>\n  </Transaction>')
+
+# This function writes generated JSON, CSV and XML source files containing rows records in total to directory
+# The rows are split as evenly as possible over the three files and written CHUNK_ROWS at a time
+# Set ndjson to write the JSON file as newline delimited JSON instead of a top level array
+# and returns the paths of the JSON, CSV and XML files
+def generate(directory, rows, seed=0, dirty=DIRTY_RATES, ndjson=False):
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    counts = [rows // 3 + (1 if i < rows % 3 else 0) for i in range(3)]
+    paths = [os.path.join(directory, name) for name in (JSON_NAME, CSV_NAME, XML_NAME)]
+
+    # This section writes the JSON file
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        f.write('' if ndjson else '[\n')
+        for start in range(0, counts[0], CHUNK_ROWS):
+            count = min(CHUNK_ROWS, counts[0] - start)
+            records = json_records(generate_columns(rng, count, dirty), pd.Series(np.arange(start, start + count)).astype(str))
+            if ndjson:
+                f.write('\n'.join(records) + '\n')
+            else:
+                f.write((',\n' if start else '') + ',\n'.join(records))
+        f.write('' if ndjson else '\n]\n')
+
+    # This section writes the CSV file
+    for start in range(0, max(counts[1], 1), CHUNK_ROWS):
+        count = min(CHUNK_ROWS, counts[1] - start)
+        frame = csv_frame(generate_columns(rng, count, dirty), pd.Series(np.arange(start, start + count)).astype(str), rng)
+        frame.to_csv(paths[1], index=False, mode='a' if start else 'w', header=not start)
+
+    # This section writes the XML file
+    with open(paths[2], 'w', encoding='utf-8') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<PartnerBatch generated="{START_DATE}T00:00:00Z" partner="{PARTNER}">\n')
+        for start in range(0, counts[2], CHUNK_ROWS):
+            count = min(CHUNK_ROWS, counts[2] - start)
+            f.write('\n'.join(xml_elements(generate_columns(rng, count, dirty), pd.Series(np.arange(start, start + count)).astype(str), rng)) + '\n')
+        f.write('</PartnerBatch>\n')
+    return paths
+
+
+# Generates the source files when the script is executed directly
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic JSON, CSV and XML transaction files for benchmarking')
+    parser.add_argument('--rows', type=int, default=10000, help='total number of records over the three files')
+    parser.add_argument('--out', default='./benchmark/data', help='directory to write the generated files to')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    parser.add_argument('--ndjson', action='store_true', help='write the JSON file as newline delimited JSON')
+    args = parser.parse_args()
+    for path in generate(args.out, args.rows, args.seed, ndjson=args.ndjson):
+        print(path)
@@ -0,0 +1,141 @@
+# Imports
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+
+# Get the parent directory of the current file
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+# Imports the script to be benchmarked and the data generator
+from src import script
+from benchmark import generate_data
+
+
+# Set variables and flags
+BASELINE_PATH = './benchmark/baseline.json'
+STAGES = ['load', 'normalize', 'merge', 'duplicates', 'flag', 'convert', 'write', 'aggregate']
+# A stage counts as a regression once its throughput drops more than TOLERANCE below the baseline
+TOLERANCE = 0.10
+
+
+# This function counts the rows in a dataframe, or in every dataframe of a list or tuple
+def count_rows(result):
+    if isinstance(result, (list, tuple)):
+        return sum(count_rows(item) for item in result)
+    return len(result) if isinstance(result, pd.DataFrame) else 0
+
+# This function runs a single pipeline stage and records its wall time, throughput and peak traced memory in results
+# and returns the result of the stage
+def measure(results, stage, rows_in, func, *args):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func(*args)
+    wall = time.perf_counter() - start
+    results[stage] = {
+        'wall_s': wall,
+        'rows_in': rows_in,
+        'rows_out': count_rows(result),
+        'rows_per_s': rows_in / wall if wall else None,
+        'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20 if tracemalloc.is_tracing() else None,
+    }
+    return result
+
+# This function runs every pipeline stage over the JSON, CSV and XML files in paths, saving the outputs to out_dir
+# Exchange rates come from the fixed generate_data.FIXED_RATES table so the benchmark never calls the frankfurter API
+# and returns a dictionary with the measurements of every stage
+def run(paths, out_dir, trace_memory=True):
+    provider = script.RateProvider(script.StaticBackend(generate_data.FIXED_RATES), cache_dir=None)
+    script.CLEAN_PATH = os.path.join(out_dir, 'CleanEntries.csv')
+    script.FLAGGED_PATH = os.path.join(out_dir, 'FlaggedEntries.csv')
+    aggregates_path = os.path.join(out_dir, 'DailyAggregates.csv')
+    results = {}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        frames = measure(results, 'load', 0, lambda: [script.open_json(paths[0]), script.open_csv(paths[1]), script.open_xml(paths[2])])
+        rows = count_rows(frames)
+        results['load']['rows_in'] = rows
+        results['load']['rows_per_s'] = rows / results['load']['wall_s']
+        frames = measure(results, 'normalize', rows, lambda: [script.normalize_json(frames[0]), script.normalize_csv(frames[1]), script.normalize_xml(frames[2])])
+        df_final = measure(results, 'merge', rows, script.merge_sources, frames)
+        del frames
+        measure(results, 'duplicates', rows, script.DuplicateIndex().check, df_final)
+        df_final, df_flag = measure(results, 'flag', rows, lambda: script.split_flagged(df_final, script.flag_codes(df_final, provider)))
+        original = df_final[['amount', 'currency']].copy()
+        df_final = measure(results, 'convert', len(df_final), script.convert_to_usd, df_final, provider)
+        measure(results, 'write', len(df_final) + len(df_flag), script.save_outputs, df_final, df_flag)
+        measure(results, 'aggregate', len(df_final) + len(df_flag), lambda: script.save_aggregates(script.daily_aggregates(df_final, original, df_flag), aggregates_path))
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return results
+
+# This function compares the measurements of a run against a baseline run
+# and returns a dictionary mapping every stage to the ratio of its throughput to the baseline throughput
+# Throughput is compared instead of wall time so runs over a different number of rows stay comparable
+def compare(results, baseline):
+    ratios = {}
+    for stage in STAGES:
+        current, previous = results['stages'].get(stage), baseline['stages'].get(stage)
+        if current and previous and current['rows_per_s'] and previous['rows_per_s']:
+            ratios[stage] = current['rows_per_s'] / previous['rows_per_s']
+    return ratios
+
+# This function prints the measurements of a run as a table, followed by the comparison against the baseline if one is given
+def report(results, ratios=None):
+    print(f"{'stage':<10} {'wall s':>9} {'rows in':>10} {'rows out':>10} {'rows/s':>12} {'peak MB':>9} {'vs baseline':>12}")
+    for stage in STAGES:
+        row = results['stages'][stage]
+        peak = f"{row['peak_mb']:.1f}" if row['peak_mb'] is not None else '-'
+        change = '-'
+        if ratios and stage in ratios:
+            change = f'{ratios[stage] - 1:+.1%}' + (' SLOWER' if ratios[stage] < 1 - TOLERANCE else '')
+        print(f"{stage:<10} {row['wall_s']:>9.3f} {row['rows_in']:>10} {row['rows_out']:>10} {row['rows_per_s'] or 0:>12.0f} {peak:>9} {change:>12}")
+    print(f"{'total':<10} {results['total_s']:>9.3f}")
+
+
+# Runs the benchmark when the script is executed directly
+# The process exits with an error code if any stage regressed against the baseline and --fail-on-regression is set
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the cleaning process on generated data')
+    parser.add_argument('--rows', type=int, default=10000, help='total number of generated records over the three files')
+    parser.add_argument('--data', help='directory with previously generated files to reuse instead of generating new ones')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the data generator')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results of this run as the new baseline')
+    parser.add_argument('--json', help='also write the results of this run to this path')
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory tracing, which slows down some stages')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with an error code if a stage regressed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data or os.path.join(tmp, 'data')
+        if args.data:
+            paths = [os.path.join(data_dir, name) for name in (generate_data.JSON_NAME, generate_data.CSV_NAME, generate_data.XML_NAME)]
+        else:
+            paths = generate_data.generate(data_dir, args.rows, args.seed)
+        start = time.perf_counter()
+        stages = run(paths, tmp, trace_memory=not args.no_memory)
+        results = {'rows': stages['load']['rows_in'], 'total_s': time.perf_counter() - start, 'stages': stages}
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    ratios = compare(results, baseline) if baseline else None
+    report(results, ratios)
+
+    for path in [args.json, args.baseline if args.save_baseline else None]:
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=1)
+    if args.fail_on_regression and ratios and any(ratio < 1 - TOLERANCE for ratio in ratios.values()):
+        exit(1)
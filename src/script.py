@@ -1,9 +1,37 @@
 
 # Imports
+# requests and the process pool are only imported by the functions that need them, so importing this module stays cheap
+import argparse
+import contextlib
+import cProfile
+import datetime
+import glob
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+import tracemalloc
 import numpy as np
 import pandas as pd
 import xml.etree.ElementTree as ET
-import requests
+
+# lxml is used to parse XML files when it is installed, the standard library parser is used otherwise
+try:
+    from lxml import etree as LXML
+except ImportError:
+    LXML = None
+
+# The resource module is only available on Unix, memory high-water marks are not recorded without it
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 # Set variables and flags
@@ -17,83 +45,548 @@ CURRENCY_PRINT_FLAG = False
 JSON_PATH = './data/transactions_online.json'
 CSV_PATH = './data/transactions_storeA.csv'
 XML_PATH = './data/transactions_partner.xml'
+CLEAN_PATH = './output/CleanEntries.csv'
+FLAGGED_PATH = './output/FlaggedEntries.csv'
+OUTPUT_COLUMNS = ['customer_id', 'transaction_id','date', 'time', 'amount', 'currency', 'payment_method', 'source_id']
 
-# Connection to the frankfurter API
-response = requests.get('https://api.frankfurter.dev/v1/latest?base=USD')
-
-# Checks whether API connected successfully else tries to establish a connection 
-# Amount of retries is established by RETRY_ATTEMPS FLAG
-if response.status_code != 200:
-    for _ in range(RETRY_ATTEMPS):
-        response = requests.get('https://api.frankfurter.dev/v1/latest?base=USD')
-        if response.status_code == 200:
-            break
-    # Checks if connection was successful after RETRY_ATTEMPS 
-    # Displays ERROR message if unsuccessful and ends program with with error code if unsuccesful else program continues
-    if response.status_code != 200:
-        print("ERROR: Unable to load API")
-        exit(1)
-    
+# Every run merges daily totals of the clean and flagged rows into the aggregate store at AGGREGATES_PATH (None disables it),
+# keyed by the UTC date, source, original currency and payment method of the rows
+AGGREGATES_PATH = './output/DailyAggregates.csv'
+AGGREGATE_KEYS = ['date', 'source_id', 'currency', 'payment_method']
+
+# Columns and types of the standardised dataframes, every source is converted to this schema once it is standardised
+# Customer ids hold only the number after 'C-' with missing or broken ids left empty instead of 'C--1',
+# the timestamp is held as a UTC datetime together with masks marking whether its date and time parts were valid
+# and the raw timestamp text of only the rows where either part was not valid (empty for every other row),
+# and the low-cardinality text fields are categories. The OUTPUT_COLUMNS layout is only rendered when saving
+FRAME_SCHEMA = {
+    'customer_id': 'Int64',
+    'transaction_id': object,
+    'timestamp': 'datetime64[ns, UTC]',
+    'date_valid': bool,
+    'time_valid': bool,
+    'timestamp_raw': object,
+    'amount': 'float64',
+    'currency': 'category',
+    'payment_method': 'category',
+    'source_id': 'category',
+}
+FRAME_COLUMNS = list(FRAME_SCHEMA)
+
+# Format tried first when parsing timestamps, values in any other format are parsed by a slower fallback
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+# Set STREAM_FLAG to process the sources in chunks of CHUNK_SIZE records instead of loading them into memory at once
+# JSON_READ_SIZE is the number of characters read from a JSON file at a time while streaming
+STREAM_FLAG = False
+CHUNK_SIZE = 100000
+JSON_READ_SIZE = 1 << 20
+# Whitespace, commas and the brackets of a top level array found between JSON records
+JSON_SEPARATORS = re.compile(r'[\s,\[\]]*')
+
+# Fields read from every XML Transaction element, XML files loaded at once are read XML_BLOCK_SIZE transactions at a time
+XML_COLUMNS = ['transaction_id','customer_id','amount','currency','when_raw','payment_method','payment_last4']
+XML_BLOCK_SIZE = 65536
+
+# Fields read from every JSON record (id, channel, customer.id, total.amount, total.currency, occurred_at and payment.method),
+# every other field is dropped as soon as its record is parsed. JSON files loaded at once are read JSON_BLOCK_SIZE records at a time
+JSON_COLUMNS = ['id','channel','customer_id','amount','currency','occurred_at','payment_method']
+JSON_BLOCK_SIZE = 65536
+
+# Set DIRECTORY_FLAG to process every JSON, CSV and XML file matching SOURCE_GLOBS instead of the three single source paths
+# The files are parsed and standardised in parallel by WORKERS processes, None uses one process per CPU core
+DIRECTORY_FLAG = False
+SOURCE_GLOBS = ['./data/**/*.json', './data/**/*.csv', './data/**/*.xml']
+WORKERS = None
+
+# Set INCREMENTAL_FLAG to only process source files that are new or changed since the last incremental run
+# Processed files are recorded in MANIFEST_PATH and the transaction ids already saved are recorded in SEEN_IDS_PATH,
+# rows with an already saved transaction id are skipped and new rows are appended to the output files
+# Incremental runs discover their source files the same way as DIRECTORY_FLAG
+INCREMENTAL_FLAG = False
+MANIFEST_PATH = './state/manifest.json'
+SEEN_IDS_PATH = './state/transaction_ids.npy'
+
+# Transactions with the same customer id, amount and currency at most DUPLICATE_WINDOW seconds apart are flagged as duplicates,
+# as are repeated transaction ids. Set DUPLICATE_INDEX_FLAG to also find duplicates of transactions processed by earlier runs,
+# which are remembered in DUPLICATE_INDEX_PATH for DUPLICATE_INDEX_DAYS days
+# The days are counted back from the newest remembered transaction, ignoring transactions dated more than
+# DUPLICATE_FUTURE_SECONDS after the current time so a single bad future date can not drop the whole index
+DUPLICATE_WINDOW = 120
+DUPLICATE_INDEX_FLAG = False
+DUPLICATE_INDEX_PATH = './state/duplicate_index.npz'
+DUPLICATE_INDEX_DAYS = 30
+DUPLICATE_FUTURE_SECONDS = 24 * 60 * 60
+
+# Set WATCH_FLAG to keep running and process new or changed source files matching SOURCE_GLOBS as they arrive
+# SOURCE_GLOBS are checked every WATCH_INTERVAL seconds and a file is picked up once its size and modification time stop changing
+# Arrivals are grouped into micro-batches of at most WATCH_BATCH_FILES files, processed WATCH_BATCH_SECONDS after their first file arrived
+# At most WATCH_QUEUE_SIZE files wait to be processed, the watcher pauses while the queue is full
+# Processed files and saved transaction ids are tracked in MANIFEST_PATH and SEEN_IDS_PATH the same way as incremental runs
+WATCH_FLAG = False
+WATCH_INTERVAL = 2.0
+WATCH_BATCH_FILES = 50
+WATCH_BATCH_SECONDS = 10.0
+WATCH_QUEUE_SIZE = 1000
+
+# Every run saves the wall time, CPU time, rows and memory use of each of its stages as a JSON file in METRICS_DIR
+# Set METRICS_DIR to None to disable saving metrics
+# Set PROFILE_STAGE to the name of a stage (e.g. 'normalize') to profile it, PROFILE_MODE selects 'cprofile' or 'tracemalloc'
+METRICS_DIR = './metrics'
+PROFILE_STAGE = None
+PROFILE_MODE = 'cprofile'
+
+# Settings of a single run that can be overridden when calling run_pipeline or on the command line
+# Each setting defaults to the module constant of the same name in upper case
+CONFIG_KEYS = ['json_path', 'csv_path', 'xml_path', 'clean_path', 'flagged_path', 'aggregates_path', 'rate_provider', 'historical_rates_flag',
+               'json_print_flag', 'csv_print_flag', 'xml_print_flag', 'flagged_print_flag', 'final_print_flag', 'currency_print_flag',
+               'stream_flag', 'chunk_size', 'directory_flag', 'source_globs', 'workers',
+               'incremental_flag', 'manifest_path', 'seen_ids_path', 'metrics_dir', 'profile_stage', 'profile_mode',
+               'watch_flag', 'watch_interval', 'watch_batch_files', 'watch_batch_seconds', 'watch_queue_size',
+               'duplicate_window', 'duplicate_index_flag', 'duplicate_index_path', 'duplicate_index_days']
+
+# Exchange rate settings
+# Rates are cached on disk in RATES_CACHE_DIR, the latest rates are refetched once they are older than RATES_CACHE_TTL seconds
+# Failed requests are retried RETRY_ATTEMPS times, waiting RETRY_BACKOFF seconds before the first retry and doubling the wait every retry
+# Only connection errors and responses with a status in RETRY_STATUS or of 500 and above are retried, other errors can never succeed
+RATES_API_URL = 'https://api.frankfurter.dev/v1'
+RATES_CACHE_DIR = './cache/rates'
+RATES_CACHE_TTL = 12 * 60 * 60
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = [429]
+BASE_CURRENCY = 'USD'
+
+# Set HISTORICAL_RATES_FLAG to convert every transaction at the rate for its own date instead of the latest rate
+# Historical rates are fetched as time series covering at most RATES_SERIES_DAYS days per request
+HISTORICAL_RATES_FLAG = True
+RATES_SERIES_DAYS = 366
+
+
+# Raised when exchange rates can not be fetched and no cached copy is available
+class RateError(Exception):
+    pass
+
+# This class fetches exchange rates from the frankfurter API
+# A single pooled session is reused for every request and failed requests that may succeed later are retried with exponential backoff
+class FrankfurterBackend:
+    def __init__(self, url=RATES_API_URL, attempts=RETRY_ATTEMPS, backoff=RETRY_BACKOFF):
+        self.url = url
+        self.attempts = attempts
+        self.backoff = backoff
+        self.session = None
+
+    # This function creates the pooled session the first time it is needed
+    def get_session(self):
+        import requests
+        if self.session is None:
+            self.session = requests.Session()
+            self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        return self.session
+
+    # This function returns the rates for base on date ('latest' for the current rates) in the frankfurter JSON format
+    # and raises a RateError if the API could not be reached after all the retries,
+    # or straight away if it rejected the request (e.g. 404 or 422 for a date or range it does not serve)
+    def fetch(self, base, date='latest'):
+        import requests
+        for attempt in range(self.attempts + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self.get_session().get(f'{self.url}/{date}', params={'base': base}, timeout=10)
+            except requests.RequestException:
+                continue
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code not in RETRY_STATUS and response.status_code < 500:
+                raise RateError(f'Exchange rates for {base} on {date} were rejected with status {response.status_code}')
+        raise RateError(f'Unable to load exchange rates for {base} on {date}')
+
+    # This function returns the rates for base on every working day from start to end in the frankfurter time series format
+    def fetch_series(self, base, start, end):
+        return self.fetch(base, f'{start}..{end}')
 
-# Gets the information from the API in JSON format
-current_prices = response.json()
+# This class serves a fixed table of exchange rates instead of calling an API
+# It can stand in for FrankfurterBackend in tests or offline runs
+class StaticBackend:
+    def __init__(self, rates, base=BASE_CURRENCY, date='latest'):
+        self.rates = rates
+        self.base = base
+        self.date = date
+
+    # This function returns the fixed rates in the frankfurter JSON format
+    def fetch(self, base, date='latest'):
+        if base != self.base:
+            raise RateError(f'No exchange rates for {base}')
+        return {'amount': 1.0, 'base': self.base, 'date': self.date if date == 'latest' else date, 'rates': dict(self.rates)}
+
+    # This function returns the fixed rates as a time series holding only the start date
+    def fetch_series(self, base, start, end):
+        if base != self.base:
+            raise RateError(f'No exchange rates for {base}')
+        return {'amount': 1.0, 'base': self.base, 'start_date': start, 'end_date': end, 'rates': {start: dict(self.rates)}}
+
+# This class provides exchange rates from a backend, caching them in memory and on disk keyed by base currency and rate date
+# Rates are only fetched the first time they are requested, a fresh cached copy avoids the request entirely
+# If the backend fails a stale cached copy is used instead, a RateError is only raised when no cached copy exists
+# Setting cache_dir to None keeps the cache in memory only
+class RateProvider:
+    def __init__(self, backend=None, cache_dir=RATES_CACHE_DIR, ttl=RATES_CACHE_TTL):
+        self.backend = backend if backend is not None else FrankfurterBackend()
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory = {}
+
+    # This function returns the path of the cache file for a base currency and rate date
+    def cache_path(self, base, date):
+        return os.path.join(self.cache_dir, f'{base}_{date}.json')
+
+    # This function returns the cached entry for a base currency and rate date, or None if it is not cached
+    def read_cache(self, base, date):
+        if (base, date) in self.memory:
+            return self.memory[(base, date)]
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.cache_path(base, date), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.memory[(base, date)] = entry
+        return entry
+
+    # This function stores an entry in the memory and disk caches
+    # The file is written under a temporary name and then renamed so readers never see a partial file
+    def write_cache(self, base, date, entry):
+        self.memory[(base, date)] = entry
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(base, date)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(path + '.tmp', path)
+
+    # This function checks whether a cached entry can be used without refetching
+    # Published rates never change, so an entry holding the rates of its own date, or fetched after its date ended
+    # (when an earlier day's rates are final for a weekend or holiday), is kept for good. Every other entry expires after the TTL,
+    # such as the latest rates or a date whose rates were not published yet when it was fetched
+    def is_fresh(self, entry, date):
+        if date != 'latest':
+            ended = datetime.datetime.fromisoformat(date).replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(days=1)
+            if entry['data'].get('date') == date or entry['fetched_at'] >= ended.timestamp():
+                return True
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    # This function returns the rates for base on date ('latest' for the current rates) in the frankfurter JSON format
+    def get(self, base=BASE_CURRENCY, date='latest'):
+        entry = self.read_cache(base, date)
+        if entry is not None and self.is_fresh(entry, date):
+            return entry['data']
+        try:
+            data = self.backend.fetch(base, date)
+        except Exception as error:
+            if entry is not None:
+                return entry['data']
+            raise RateError(f'Unable to load exchange rates for {base} on {date}') from error
+        self.write_cache(base, date, {'fetched_at': time.time(), 'data': data})
+        return data
+
+    # This function returns a table of rates for base with one row per date in dates (ISO date strings) and one column per currency
+    # Dates that are not cached yet are fetched together as time series instead of one request per date,
+    # dates without published rates (weekends and holidays) use the rates of the closest earlier working day
+    # Dates of a failed series use their stale cached copy, dates without any rates (e.g. before the API's first published day)
+    # are left out of the table so the caller can fall back on the latest rates
+    def get_history(self, base, dates):
+        dates = sorted(set(dates))
+        missing = []
+        for date in dates:
+            entry = self.read_cache(base, date)
+            if entry is None or not self.is_fresh(entry, date):
+                missing.append(date)
+        for batch in self.series_batches(missing):
+            # The series starts a week early so the first dates always have an earlier working day to fall back on
+            start = (datetime.date.fromisoformat(batch[0]) - datetime.timedelta(days=7)).isoformat()
+            try:
+                series = self.backend.fetch_series(base, start, batch[-1])
+            except Exception:
+                # Dates of a failed series are never fetched one at a time, which would retry every date on its own
+                continue
+            published = sorted(series['rates'])
+            for date in batch:
+                index = np.searchsorted(published, date, side='right') - 1
+                if index >= 0:
+                    rate_date = published[index]
+                    data = {'amount': 1.0, 'base': base, 'date': rate_date, 'rates': series['rates'][rate_date]}
+                    self.write_cache(base, date, {'fetched_at': time.time(), 'data': data})
+        cached = {date: self.read_cache(base, date) for date in dates}
+        return pd.DataFrame.from_dict({date: entry['data']['rates'] for date, entry in cached.items() if entry is not None}, orient='index')
+
+    # This function groups sorted ISO date strings into batches spanning at most RATES_SERIES_DAYS days
+    def series_batches(self, dates):
+        batches = []
+        for date in dates:
+            day = datetime.date.fromisoformat(date)
+            if batches and (day - datetime.date.fromisoformat(batches[-1][0])).days < RATES_SERIES_DAYS:
+                batches[-1].append(date)
+            else:
+                batches.append([date])
+        return batches
+
+# Rate provider used by the cleaning process unless another one is given, such as the rate_provider setting of a run
+RATE_PROVIDER = RateProvider()
+
+# This function returns the current exchange rates with USD as the base currency from provider, or from RATE_PROVIDER
+def get_rates(provider=None):
+    return (provider or RATE_PROVIDER).get(BASE_CURRENCY)
 
 # This function converts currency value to USD using the data from the frankfurter API
 # and returns the converted amount
-def convert_currency(amount, currency):
+# If a date is given the rate for that date is used instead of the latest rate
+def convert_currency(amount, currency, date='latest'):
     if currency == 'USD':
         return amount
     else:
-        return amount/current_prices['rates'].get(currency)
+        return amount/RATE_PROVIDER.get(BASE_CURRENCY, date)['rates'].get(currency)
+
+# This function looks up the exchange rate from USD to each currency for all rows at once from provider (RATE_PROVIDER by default)
+# and returns an array of rates, using the rate for the UTC date of each row's timestamp when historical
+# (HISTORICAL_RATES_FLAG by default) is set
+# The distinct dates are fetched once into a compact table and every row's rate is read from it with a single reindex
+# Rows whose date or currency has no historical rate fall back to the latest rate
+def lookup_rates(timestamps, currencies, provider=None, historical=None):
+    provider = provider or RATE_PROVIDER
+    days = pd.Series(timestamps).reset_index(drop=True).dt.floor('D')
+    currencies = pd.Series(currencies, dtype='string').reset_index(drop=True)
+    rates = np.full(len(days), np.nan)
+    if HISTORICAL_RATES_FLAG if historical is None else historical:
+        table = provider.get_history(BASE_CURRENCY, [day.strftime('%Y-%m-%d') for day in days.dropna().unique()])
+        if len(table):
+            table.index = pd.to_datetime(table.index, utc=True)
+            rates = table.stack().reindex(pd.MultiIndex.from_arrays([days, currencies])).to_numpy(dtype=float)
+    latest = pd.Series(get_rates(provider)['rates'], dtype=float)
+    rates = np.where(np.isnan(rates), latest.reindex(currencies).to_numpy(), rates)
+    rates[(currencies == BASE_CURRENCY).to_numpy(dtype=bool, na_value=False)] = 1.0
+    return rates
     
+# Flag reasons in bit order, the position of a reason in this list is the bit it sets in a row's flag code
+FLAG_REASONS = ['Invalid Customer ID', 'Invalid Transaction ID', 'Invalid Date Value', 'Invalid Time Value',
+                'Invalid Amount', 'Invalid Currency', 'Invalid Payment Method', 'Invalid Source ID']
+# Reason set by the duplicate check, which compares rows with each other instead of checking every row on its own,
+# it uses the bit after the reasons in FLAG_REASONS
+DUPLICATE_REASON = 'Duplicate Transaction'
+DUPLICATE_BIT = np.uint16(1 << len(FLAG_REASONS))
+ALL_FLAG_REASONS = FLAG_REASONS + [DUPLICATE_REASON]
+
+# Columns of the aggregate store, with a count of flagged rows for every flag reason
+AGGREGATE_REASON_COLUMNS = [reason.lower().replace(' ', '_') for reason in ALL_FLAG_REASONS]
+AGGREGATE_COLUMNS = AGGREGATE_KEYS + ['clean_count', 'amount_sum', 'usd_sum', 'usd_min', 'usd_max', 'flagged_count'] + AGGREGATE_REASON_COLUMNS
+
+# This function evaluates every suspicious data check once over whole columns
+# and returns a boolean matrix with one row per record and one column per reason in FLAG_REASONS
+# Standardised dataframes are checked on their empty customer ids and the validity masks set while parsing their timestamps,
+# rows in the output layout (such as single rows passed to flag) are checked on their rendered customer id, date and time strings
+# Currencies are valid when provider (RATE_PROVIDER by default) has rates for them
+def flag_matrix(df, provider=None):
+    if 'date_valid' in df:
+        customer_invalid = df['customer_id'].isna()
+        date_invalid = ~df['date_valid'].astype(bool)
+        time_invalid = ~df['time_valid'].astype(bool)
+    else:
+        customer_invalid = df['customer_id'] == 'C--1'
+        date = df['date'].astype('string')
+        time = df['time'].astype('string')
+        date_invalid = date.isna() | (date == '_') | date.str.contains(':') | (date.str.count('-') != 2)
+        time_invalid = time.isna() | (time.str.count(':') != 3) | (time.str.count(r'\+') != 1)
+    rates = get_rates(provider)
+    currencies = set(rates['rates']) | {rates['base']}
+    checks = [
+        customer_invalid,
+        df['transaction_id'].isna(),
+        date_invalid,
+        time_invalid,
+        ~(pd.to_numeric(df['amount'], errors='coerce') > 0),
+        ~df['currency'].isin(currencies),
+        df['payment_method'].isna(),
+        df['source_id'].isna(),
+    ]
+    # Missing values only survive the comparisons when the field itself is missing, which is always suspicious
+    return np.column_stack([np.asarray(check.fillna(True), dtype=bool) for check in checks])
+
+# This function packs the boolean matrix from flag_matrix into a single integer flag code per row
+# a code of 0 means the row is clean
+def flag_codes(df, provider=None):
+    bits = (1 << np.arange(len(FLAG_REASONS))).astype(np.uint16)
+    return (flag_matrix(df, provider) * bits).sum(axis=1, dtype=np.uint16)
+
+# This function decodes flag codes back into the lists of flag reasons they represent
+# each distinct code is only decoded once
+def decode_flags(codes):
+    labels = {code: [reason for bit, reason in enumerate(ALL_FLAG_REASONS) if code >> bit & 1] for code in np.unique(codes).tolist()}
+    return [labels[code] for code in np.asarray(codes).tolist()]
+
 # This function determines which suspicious data flags are present in a row of data
 # and returns a list contain all flags present in said row
+# It runs the same checks as flag_matrix on a single row dataframe so row and column results always agree
 def flag(row):
-    flags = []
-    if row['customer_id'] == 'C--1':
-        flags.append('Invalid Customer ID')
-    if pd.isna(row['transaction_id']):
-        flags.append('Invalid Transaction ID')
-    if  pd.isna(row['date']) or row['date'] == '_':
-        flags.append('Invalid Date Value')
-    elif ':' in row['date']:
-        flags.append('Invalid Date Value')
-    elif row['date'].count('-') != 2:
-        flags.append('Invalid Date Value')
-    if pd.isna(row['time']):
-        flags.append('Invalid Time Value')
-    elif row['time'].count(':') != 3:
-        flags.append('Invalid Time Value')
-    elif row['time'].count(r'\+') != 1:
-        flags.append('Invalid Time Value')
-    if row['amount'] <= 0:
-        flags.append('Invalid Amount')
-    if row['currency'] not in current_prices['rates'] and row['currency'] != current_prices['base']:
-        flags.append('Invalid Currency')
-    if pd.isna(row['payment_method']):
-        flags.append('Invalid Payment Method')
-    if pd.isna(row['source_id']):
-        flags.append('Invalid Source ID')
-    return flags
+    return decode_flags(flag_codes(pd.DataFrame([row])))[0]
+
+# This function hashes the customer id, amount in cents and currency of every row into a 64 bit blocking key,
+# so only rows sharing a key are ever compared with each other
+# and returns the keys together with a boolean array marking the rows complete enough to be matched
+# Rows without a customer id, amount, currency or a valid date and time are never matched, they are already flagged
+def duplicate_keys(df):
+    cents = np.round(df['amount'].to_numpy(dtype=float) * 100)
+    matchable = (df['customer_id'].notna().to_numpy() & ~np.isnan(cents) & df['currency'].notna().to_numpy()
+                 & df['date_valid'].to_numpy(dtype=bool) & df['time_valid'].to_numpy(dtype=bool))
+    parts = pd.DataFrame({
+        'customer_id': df['customer_id'].fillna(0).to_numpy(dtype=np.int64),
+        'cents': np.nan_to_num(cents).astype(np.int64),
+        'currency': df['currency'].astype('category'),
+    })
+    return pd.util.hash_pandas_object(parts, index=False).to_numpy(), matchable
+
+# This class finds duplicate transactions, remembering the blocking keys and UTC times of every row it has checked
+# The keys and times are kept sorted by key and then time, so only the new rows are sorted and their neighbours in the index
+# are found with binary searches, instead of sorting the whole index again or comparing every pair
+# Checked rows are only merged into the index by commit, so rows that end up not being saved are never matched later
+# An index saved with save and opened with load lets later runs find duplicates of transactions from earlier days
+class DuplicateIndex:
+    def __init__(self, keys=None, times=None, ids=None, id_times=None):
+        self.keys = np.array([], dtype=np.uint64) if keys is None else keys
+        self.times = np.array([], dtype=np.int64) if times is None else times
+        self.ids = np.array([], dtype=np.uint64) if ids is None else ids
+        self.id_times = np.array([], dtype=np.int64) if id_times is None else id_times
+        self.pending = None
+
+    # This function returns the index saved at path, or an empty index if none has been saved yet
+    # Indexes saved before transaction ids were kept load with no transaction ids
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as saved:
+            if 'ids' not in saved:
+                return cls(saved['keys'], saved['times'])
+            return cls(saved['keys'], saved['times'], saved['ids'], saved['id_times'])
+
+    # This function drops rows more than days days older than the newest row, days of None keeps every row
+    # Rows dated more than DUPLICATE_FUTURE_SECONDS after the current time are kept but never count as the newest row
+    def prune(self, days=DUPLICATE_INDEX_DAYS):
+        if days is None or not len(self.times):
+            return
+        plausible = self.times[self.times <= (time.time() + DUPLICATE_FUTURE_SECONDS) * 10**9]
+        if len(plausible):
+            oldest = plausible.max() - days * 86400 * 10**9
+            keep = self.times >= oldest
+            self.keys, self.times = self.keys[keep], self.times[keep]
+            keep = self.id_times >= oldest
+            self.ids, self.id_times = self.ids[keep], self.id_times[keep]
+
+    # This function saves the index to path after pruning it to the last days days
+    # The file is written under a temporary name and then renamed so a failed run never leaves a partial index
+    def save(self, path, days=DUPLICATE_INDEX_DAYS):
+        self.prune(days)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, keys=self.keys, times=self.times, ids=self.ids, id_times=self.id_times)
+        os.replace(path + '.tmp', path)
+
+    # This function checks standardised rows for duplicates, keeping them to be added to the index by commit
+    # and returns a boolean array marking every row that repeats a transaction already seen
+    # A row repeats a transaction if an earlier row in df or a row in the index has the same transaction id, or if a row in df
+    # or in the index has the same customer id, amount and currency at a UTC time at most window seconds apart.
+    # Within df the row that comes first in time (then in row order) is kept and the rows matching it are marked
+    def check(self, df, window=DUPLICATE_WINDOW):
+        ids = df['transaction_id']
+        present = ids.notna().to_numpy()
+        hashes = pd.util.hash_array(ids.astype(str).to_numpy(dtype=object), categorize=False)
+        duplicates = present & pd.Series(hashes).duplicated().to_numpy()
+        indexed = np.zeros(len(df), dtype=bool)
+        id_after = np.searchsorted(self.ids, hashes)
+        found = present & (id_after < len(self.ids))
+        indexed[found] = self.ids[id_after[found]] == hashes[found]
+        duplicates |= indexed
+
+        # Every transaction id not yet in the index is added with the time of its first row,
+        # or the current time when that row has no valid timestamp so the id is kept for a full pruning period
+        new = np.flatnonzero(present & ~indexed)
+        new_ids, first = np.unique(hashes[new], return_index=True)
+        first = new[first]
+        id_times = df['timestamp'].to_numpy(dtype='datetime64[ns]')[first]
+        id_times = np.where(np.isnat(id_times), np.datetime64(time.time_ns(), 'ns'), id_times).view(np.int64)
+
+        keys, matchable = duplicate_keys(df)
+        rows = np.flatnonzero(matchable)
+        times = df['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)[rows]
+        # The sort is stable, so new rows with equal keys and times keep their row order
+        order = np.lexsort((times, keys[rows]))
+        keys, times = keys[rows][order], times[order]
+        window = int(window * 10**9)
+
+        # A new row repeats the new row just before it in sorted order when both share a key and are close enough in time
+        repeats = np.zeros(len(rows), dtype=bool)
+        repeats[1:] = (keys[1:] == keys[:-1]) & (times[1:] - times[:-1] <= window)
+        # A new row also repeats the index rows just before and after it when they share its key and are close enough in time,
+        # index rows with an equal key and time come before the new row
+        after = self.positions(keys, times)
+        before = after - 1
+        found = before >= 0
+        repeats[found] |= (self.keys[before[found]] == keys[found]) & (times[found] - self.times[before[found]] <= window)
+        found = after < len(self.keys)
+        repeats[found] |= (self.keys[after[found]] == keys[found]) & (self.times[after[found]] - times[found] <= window)
+
+        duplicates[rows[order]] |= repeats
+        self.pending = keys, times, after, new_ids, id_times, np.searchsorted(self.ids, new_ids)
+        return duplicates
+
+    # This function returns the position of the first index row after every (key, time) pair in sort order
+    # Every key's rows are found with a binary search over the keys, and the time within those rows with a vectorized binary search
+    def positions(self, keys, times):
+        low = np.searchsorted(self.keys, keys, side='left')
+        high = np.searchsorted(self.keys, keys, side='right')
+        searching = low < high
+        while searching.any():
+            middle = (low + high) // 2
+            later = self.times[np.minimum(middle, len(self.times) - 1)] > times
+            high = np.where(searching & later, middle, high)
+            low = np.where(searching & ~later, middle + 1, low)
+            searching = low < high
+        return low
+
+    # This function merges the rows and transaction ids of the last check into the index, keeping both sorted
+    def commit(self):
+        if self.pending is not None:
+            keys, times, positions, ids, id_times, id_positions = self.pending
+            self.keys, self.times = np.insert(self.keys, positions, keys), np.insert(self.times, positions, times)
+            self.ids, self.id_times = np.insert(self.ids, id_positions, ids), np.insert(self.id_times, id_positions, id_times)
+            self.pending = None
 
 
 # This function tries to open the JSON file containing the required data 
-# and returns the JSON data loading into a pandas dataframe. 
+# and returns the JSON data loading into a pandas dataframe holding only the JSON_COLUMNS fields.
+# The file may be a top level array of records or newline delimited JSON
+# If chunksize is set it instead returns a generator of dataframes holding at most chunksize records each,
+# the file is opened straight away so an invalid path is still reported here
 # If it failed to open the JSON file it displays an error message before exiting the program with a error code       
-def open_json(FilePath):
+def open_json(FilePath, chunksize=None):
     try:
-        df = pd.read_json(FilePath)
-        return df
+        if chunksize:
+            return iter_json(open(FilePath, encoding='utf-8'), chunksize)
+        with open(FilePath, encoding='utf-8') as file:
+            blocks = list(read_json_blocks(file, JSON_BLOCK_SIZE))
+        columns = {name: np.concatenate([block[name] for block in blocks]) if blocks else np.empty(0, dtype=object) for name in JSON_COLUMNS}
+        return json_columns_to_frame(columns)
     except:
         print("ERROR: Invalid Path for JSON file")
         return -1
     
 # This function tries to open the CSV file containing the required data 
 # and returns the CSV data loading into a pandas dataframe. 
+# If chunksize is set it instead returns a reader that yields dataframes holding at most chunksize rows each
 # If it failed to open the CSV file it displays an error message before exiting the program with a error code     
-def open_csv(FilePath):
+def open_csv(FilePath, chunksize=None):
     try:
-        df = pd.read_csv(FilePath)
+        df = pd.read_csv(FilePath, chunksize=chunksize)
         return df
     except:
         print("ERROR: Invalid Path for CSV file")
@@ -101,174 +594,1235 @@ def open_csv(FilePath):
 
 # This function tries to open the XML file containing the required data 
 # and returns the XML data loading into a pandas dataframe. 
+# If chunksize is set it instead returns a generator of dataframes holding at most chunksize transactions each,
+# the file is opened straight away so an invalid path is still reported here
 # If it failed to open the XML file it displays an error message before exiting the program with a error code     
-def open_xml(FilePath):
+def open_xml(FilePath, chunksize=None):
     try:
-        root = ET.parse(FilePath).getroot()
-        partner_name = root.get('partner')
-        rows = []
-        for tx in root.findall('.//Transaction'):
-            cust = tx.find('Customer')
-            pay = tx.find('Payment')
-            amt = tx.find('Amount')
-            rows.append({
-                'transaction_id': tx.get('id'),
-                'customer_id': (cust.get('id') if cust is not None and cust.get('id','').strip() else 'C--1'),
-                'amount': (amt.text.strip() if amt is not None and amt.text else None),
-                'currency': (amt.get('currency') if amt is not None else None),
-                'when_raw': tx.findtext('When'),
-                'payment_method': (pay.get('method') if pay is not None else None),
-                'payment_last4': (pay.get('last4') if pay is not None else None),
-                'source_id': partner_name,
-            })
-
-        df = pd.DataFrame(rows)
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        df['when'] = pd.to_datetime(df['when_raw'], errors='coerce', utc=True)
-        df = df[['transaction_id','customer_id','amount','currency','when','payment_method','payment_last4','when_raw','source_id']]
-        return df
+        if chunksize:
+            return iter_xml(open(FilePath, 'rb'), chunksize)
+        with open(FilePath, 'rb') as file:
+            blocks = list(read_xml_blocks(file, XML_BLOCK_SIZE))
+        partner_name = blocks[0][0] if blocks else None
+        columns = {name: np.concatenate([block[name] for _, block in blocks]) if blocks else np.empty(0, dtype=object) for name in XML_COLUMNS}
+        return xml_columns_to_frame(columns, partner_name)
     except:
         print('ERROR: Invalid Path for XML file')
         return -1
 
+# This generator yields the Transaction elements of an open XML file one at a time together with the partner name of the batch
+# lxml is used when it is installed, only parsing Transaction elements, otherwise the standard library parser is used
+# Every transaction is freed once the caller has read it so the parsed tree never grows beyond a single transaction
+def xml_transactions(file):
+    if LXML is not None:
+        root = None
+        for _, elem in LXML.iterparse(file, events=('end',), tag='Transaction'):
+            if root is None:
+                root = elem.getroottree().getroot()
+            yield root.get('partner'), elem
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    else:
+        root = None
+        for event, elem in ET.iterparse(file, events=('start', 'end')):
+            if root is None:
+                # Clearing the root also removes its attributes so the partner name is read straight away
+                root = elem
+                partner_name = root.get('partner')
+            elif event == 'end' and elem.tag == 'Transaction':
+                yield partner_name, elem
+                elem.clear()
+                root.clear()
 
+# This generator reads the transactions of an open XML file into blocks of preallocated column arrays
+# and yields the partner name together with a dictionary of column arrays for every block of at most size transactions
+# Each transaction's child elements are read in a single pass instead of searching for every field separately
+def read_xml_blocks(file, size):
+    columns = None
+    count = 0
+    partner_name = None
+    for partner_name, tx in xml_transactions(file):
+        if columns is None:
+            columns = {name: np.empty(size, dtype=object) for name in XML_COLUMNS}
+            columns['customer_id'][:] = 'C--1'
+            ids, customers, amounts, currencies, whens, methods, last4s = (columns[name] for name in XML_COLUMNS)
+        ids[count] = tx.get('id')
+        for child in tx:
+            tag = child.tag
+            if tag == 'Customer':
+                customer = child.get('id')
+                if customer and customer.strip():
+                    customers[count] = customer
+            elif tag == 'Amount':
+                amounts[count] = child.text.strip() if child.text else None
+                currencies[count] = child.get('currency')
+            elif tag == 'When':
+                whens[count] = child.text
+            elif tag == 'Payment':
+                methods[count] = child.get('method')
+                last4s[count] = child.get('last4')
+        count += 1
+        if count == size:
+            yield partner_name, columns
+            columns = None
+            count = 0
+    if columns is not None:
+        yield partner_name, {name: values[:count] for name, values in columns.items()}
 
-# This section cleans and standardise the columns from the JSON file
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_json = open_json(JSON_PATH)
-    df_json.rename(columns = {'id': 'transaction_id'}, inplace=True)
-    df_json.rename(columns = {'channel': 'source_id'}, inplace=True)
-    df_json['customer_id'] = df_json['customer'].apply(lambda x: x.get('id') if isinstance(x, dict) else None)
-    df_json['customer_id'] = df_json['customer_id'].fillna('C--1')
-    df_json['payment_method'] = df_json['payment'].apply(lambda x: x.get('method') if isinstance(x, dict) else None)
-    df_json['amount'] = df_json['total'].apply(lambda x: x.get('amount') if isinstance(x, dict) else None)
-    df_json['currency'] = df_json['total'].apply(lambda x: x.get('currency') if isinstance(x, dict) else None)
-    df_json[['date', 'time']] = df_json['occurred_at'].astype('string').str.replace(r'[a-zA-Z]', ' ', regex=True).str.strip().str.split(' ', expand=True)
-    mask = df_json['date'].str.contains(':')
-    df_json.loc[mask, ['date', 'time']] = df_json.loc[mask, ['time', 'date']].values
-    df_json.drop(columns=['occurred_at'])
-except:
-    print("ERROR: Incorrect JSON file format")
-    exit(1)
-
-# This section cleans and standardise the columns from the CSV file
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_csv = open_csv(CSV_PATH)
-    df_csv['customer_id'] = pd.to_numeric(df_csv['customer_id'], errors='coerce').fillna(-1).astype(int)
-    df_csv['customer_id'] = 'C-' + df_csv['customer_id'].astype('string') 
-    df_csv[['date', 'time']] = df_csv['timestamp'].astype('string').str.replace(r'[a-zA-Z]', ' ', regex=True).str.strip().str.split(' ', expand=True)
-    df_csv.drop(columns=['timestamp'], inplace=True)
-    df_csv.rename(columns = {'store_id': 'source_id'}, inplace=True)
-    mask = df_csv['date'].str.contains(':')
-    df_csv.loc[mask, ['date', 'time']] = df_csv.loc[mask, ['time', 'date']].values
-    
-except:
-    print("ERROR: Incorrect CSV file format")
-    exit(1)
-df_csv.fillna(pd.NA)
-# This section cleans and standardise the columns from the XML file
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_xml = open_xml(XML_PATH)
-    df_xml['customer_id'] = pd.to_numeric(df_xml['customer_id'], errors='coerce').fillna(-1).astype(int)
-    df_xml['customer_id'] = 'C-' + df_xml['customer_id'].astype('string') 
-    df_xml[['date', 'time']] = df_xml['when_raw'].astype('string').str.replace(r'[a-zA-Z]', ' ', regex=True).str.strip().str.split(' ', expand=True)
-    df_xml['time'] = df_xml['time'] + str('+00:00')
-    df_xml.drop(columns=['when_raw'], inplace=True)
-    df_xml.rename(columns = {'source': 'source_id'}, inplace=True)
-    mask = df_xml['date'].str.contains(':')
-    df_xml.loc[mask, ['date', 'time']] = df_xml.loc[mask, ['time', 'date']].values
-except:
-    print("ERROR: Incorrect XML file format")
-    exit(1)
-
-
-
-# This section merges the now standardised data from the various sources
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_final = pd.concat([df_json[['customer_id', 'transaction_id','date', 'time', 'amount', 'currency', 'payment_method', 'source_id']], df_csv[['customer_id', 'transaction_id','date', 'time', 'amount', 'currency', 'payment_method', 'source_id']]], ignore_index=True)
-    df_final = pd.concat([df_final, df_xml[['customer_id', 'transaction_id','date', 'time', 'amount', 'currency', 'payment_method', 'source_id']]], ignore_index=True)
-except:
-    print("ERROR: Failed to merge dataframes")
-    exit(1)
-
-# This section collects suspicious data into a dataframe so as to be easily examined
-# This section adds a flags column to the new dataframe which is generated using the flag method
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_flag = pd.concat([df_final[df_final['amount'] <= 0], df_final[df_final['customer_id'].str.contains('C--1', na=False)], df_final[pd.isna(df_final['transaction_id'])],
-                         df_final[df_final['date'] == '_'], df_final[pd.isna(df_final['time'])], df_final[pd.isna(df_final['payment_method'])],
-                         df_final[pd.isna(df_final['source_id'])], df_final[df_final['date'].str.contains(':', na=False)], df_final[pd.isna(df_final['date'])],
-                         df_final[df_final['date'].fillna("").str.count('-') != 2], df_final[df_final['time'].fillna("").str.count(':') != 3], df_final[df_final['time'].fillna("").str.count(r'\+') != 1]], ignore_index=True)
-    df_flag = df_flag.drop_duplicates()
-    df_flag['flags'] = df_flag.apply(flag, axis=1)
-except:
-    print("ERROR: Failed to create flagged output dataframe")
-    exit(1)
-
-
-# This section removes suspicious from the clean dataframe
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_final = df_final[~df_final['customer_id'].str.contains('C--1', na=False)]
-    df_final = df_final[~df_final['date'].str.contains(':', na=False)]
-    df_final = df_final[~pd.isna(df_final['transaction_id'])]
-    df_final = df_final[df_final['date'] != '_']
-    df_final = df_final[~pd.isna(df_final['date'])]
-    df_final = df_final[df_final['date'].fillna("").str.count('-') == 2]
-    df_final = df_final[~pd.isna(df_final['time'])]
-    df_final = df_final[df_final['time'].fillna("").str.count(':') == 3]
-    df_final = df_final[df_final['time'].fillna("").str.count(r'\+') == 1]
-    df_final = df_final[df_final['amount'] > 0]
-    df_final = df_final[~pd.isna(df_final['payment_method'])]
-    df_final = df_final[~pd.isna(df_final['source_id'])]
-except:
-    print("ERROR: Failed to remove suspecious entries")
-    exit(1)
-
-
-# This section converts all the amount values in the clean dataframe to USD
-# The convert_currency method if used to achive this
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_final['amount'] = [convert_currency(a,c) for a,c in zip(df_final['amount'], df_final['currency'])]
-    df_final['currency'] = 'USD'
-    df_final.reset_index()
-except:
-    print("ERROR: Failed to convert values to USD")
-    exit(1)
+# This function turns a dictionary of XML column arrays into a dataframe with typed columns
+def xml_columns_to_frame(columns, partner_name):
+    df = pd.DataFrame(columns, columns=XML_COLUMNS)
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').astype(float)
+    df['source_id'] = partner_name
+    return df
 
+# This generator streams the transactions of an open XML file
+# and yields dataframes of at most chunksize transactions
+# Every finished transaction is freed from the tree so memory use is bound by the chunk size and not the file size
+def iter_xml(file, chunksize):
+    with file:
+        for partner_name, columns in read_xml_blocks(file, chunksize):
+            yield xml_columns_to_frame(columns, partner_name)
 
+# This generator incrementally parses the records of a JSON file one at a time
+# It supports both a top level array of records and newline delimited JSON (one record per line)
+# The file is read in blocks of JSON_READ_SIZE characters so the whole file is never held in memory
+def iter_json_records(file):
+    decoder = json.JSONDecoder()
+    skip = JSON_SEPARATORS.match
+    buffer = ''
+    eof = False
+    while not eof:
+        block = file.read(JSON_READ_SIZE)
+        eof = not block
+        buffer += block
+        pos = 0
+        while True:
+            pos = skip(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # A record cut off by the end of the block is completed by the next block
+                if eof:
+                    raise
+                break
+            yield record
+        buffer = buffer[pos:]
 
-# This section uses flags set initially to determine which dataframes to display for quick analysis or debugging
-# Default all print flags set to False
-if JSON_PRINT_FLAG:
-    print(df_json)
-    print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
-if CSV_PRINT_FLAG:
-    print(df_csv)
-    print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
-if XML_PRINT_FLAG:
-    print(df_xml)
-    print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
-if FLAGGED_PRINT_FLAG:
-    print(df_flag)
-    print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
-if FINAL_PRINT_FLAG:
-    print(df_final)
+# This generator reads the records of an open JSON file into blocks of preallocated column arrays
+# and yields a dictionary of column arrays for every block of at most size records
+# Only the nested fields in JSON_COLUMNS are copied out of each record before it is discarded,
+# missing fields and fields nested in a value that is not an object are left as None
+def read_json_blocks(file, size):
+    columns = None
+    count = 0
+    for record in iter_json_records(file):
+        if columns is None:
+            columns = {name: np.empty(size, dtype=object) for name in JSON_COLUMNS}
+            ids, channels, customers, amounts, currencies, occurred, methods = (columns[name] for name in JSON_COLUMNS)
+        get = record.get
+        ids[count] = get('id')
+        channels[count] = get('channel')
+        occurred[count] = get('occurred_at')
+        customer = get('customer')
+        if isinstance(customer, dict):
+            customers[count] = customer.get('id')
+        total = get('total')
+        if isinstance(total, dict):
+            amounts[count] = total.get('amount')
+            currencies[count] = total.get('currency')
+        payment = get('payment')
+        if isinstance(payment, dict):
+            methods[count] = payment.get('method')
+        count += 1
+        if count == size:
+            yield columns
+            columns = None
+            count = 0
+    if columns is not None:
+        yield {name: values[:count] for name, values in columns.items()}
+
+# This function turns a dictionary of JSON column arrays into a dataframe with typed columns
+def json_columns_to_frame(columns):
+    df = pd.DataFrame(columns, columns=JSON_COLUMNS)
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').astype(float)
+    return df
+
+# This generator yields dataframes of at most chunksize records from an open JSON file
+def iter_json(file, chunksize):
+    with file:
+        for columns in read_json_blocks(file, chunksize):
+            yield json_columns_to_frame(columns)
+
+
+# This function parses a column of raw timestamps into UTC datetimes
+# and returns the parsed timestamps together with boolean arrays marking which rows had a valid date and a valid time
+# Values already parsed into datetimes are only converted to UTC, strings are first parsed in one vectorized pass using fmt
+# and only the rows that do not match fmt are passed to parse_timestamp_parts
+# Timestamps without a UTC offset are assumed to be in UTC
+def parse_timestamps(values, fmt=TIMESTAMP_FORMAT):
+    values = pd.Series(values).reset_index(drop=True)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        timestamps = values.dt.tz_localize('UTC') if values.dt.tz is None else values.dt.tz_convert('UTC')
+        valid = timestamps.notna().to_numpy()
+        return timestamps, valid, valid.copy()
+    text = values.astype('string').str.strip()
+    timestamps = pd.to_datetime(text, format=fmt, utc=True, errors='coerce')
+    date_valid = timestamps.notna().to_numpy()
+    time_valid = date_valid.copy()
+    retry = ~date_valid & text.notna().to_numpy()
+    if retry.any():
+        parts, date_valid[retry], time_valid[retry] = parse_timestamp_parts(text[retry])
+        timestamps.loc[parts.index] = parts
+    return timestamps, date_valid, time_valid
+
+# This function parses timestamps in any layout by finding their date and time parts separately
+# so swapped parts and other separators are accepted and a broken date or time only invalidates its own part
+# and returns the parsed UTC timestamps, rows with a valid date but no valid time are set to midnight of that date
+# and rows with a valid time but no valid date are set to that time on 1970-01-01, so the valid part can still be rendered
+def parse_timestamp_parts(text):
+    date = text.str.extract(r'(\d{4}-\d{2}-\d{2})', expand=False)
+    time = text.str.extract(r'(\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?)', expand=False)
+    day = pd.to_datetime(date, format='%Y-%m-%d', utc=True, errors='coerce')
+    clock = pd.to_datetime('1970-01-01T' + time, format='ISO8601', utc=True, errors='coerce')
+    time_valid = clock.notna().to_numpy()
+    timestamps = day.where(~time_valid, day.fillna(pd.Timestamp(0, tz='UTC')) + (clock - pd.Timestamp(0, tz='UTC')))
+    return timestamps, day.notna().to_numpy(), time_valid
+
+# This function replaces a raw timestamp column of a source dataframe with the parsed timestamp and its validity masks
+# The raw value is only kept for rows where the date or time was not valid, so the flagged output can show what was wrong
+def set_timestamps(df, column):
+    timestamps, date_valid, time_valid = parse_timestamps(df[column])
+    raw = df[column].astype(object).where(~(date_valid & time_valid), None)
+    df = df.drop(columns=[column])
+    df['timestamp'] = timestamps.array
+    df['date_valid'] = date_valid
+    df['time_valid'] = time_valid
+    df['timestamp_raw'] = raw
+    return df
+
+# This function parses customer ids, removing the prefix from ids stored with one
+# and returns them as nullable integers, ids that are missing or not a number are left empty
+def parse_customer_ids(values, prefix=None):
+    values = pd.Series(values)
+    if prefix:
+        values = values.astype('string').str.removeprefix(prefix)
+    return np.trunc(pd.to_numeric(values, errors='coerce').astype(float)).astype('Int64')
+
+# This function converts a standardised dataframe to the columns and types of FRAME_SCHEMA
+# and returns the converted dataframe, any other column is dropped
+# A dataframe without raw timestamps, such as one built from already parsed datetimes, gets an empty timestamp_raw column
+def enforce_schema(df):
+    if 'timestamp_raw' not in df:
+        df = df.assign(timestamp_raw=None)
+    return df[FRAME_COLUMNS].astype(FRAME_SCHEMA)
+
+# This function cleans and standardise the columns from the JSON data
+# and returns the standardised dataframe
+def normalize_json(df_json):
+    df_json = df_json.rename(columns = {'id': 'transaction_id', 'channel': 'source_id'})
+    df_json['customer_id'] = parse_customer_ids(df_json['customer_id'], 'C-')
+    return enforce_schema(set_timestamps(df_json, 'occurred_at'))
+
+# This function cleans and standardise the columns from the CSV data
+# and returns the standardised dataframe
+def normalize_csv(df_csv):
+    df_csv = df_csv.rename(columns = {'store_id': 'source_id'})
+    df_csv['customer_id'] = parse_customer_ids(df_csv['customer_id'])
+    return enforce_schema(set_timestamps(df_csv, 'timestamp'))
+
+# This function cleans and standardise the columns from the XML data
+# and returns the standardised dataframe
+def normalize_xml(df_xml):
+    df_xml = df_xml.rename(columns = {'source': 'source_id'})
+    df_xml['customer_id'] = parse_customer_ids(df_xml['customer_id'])
+    return enforce_schema(set_timestamps(df_xml, 'when_raw'))
+
+# Opening and standardising function for every supported source file extension
+SOURCE_FORMATS = {
+    '.json': (open_json, normalize_json),
+    '.csv': (open_csv, normalize_csv),
+    '.xml': (open_xml, normalize_xml),
+}
+
+# Raised when a source file can not be opened or standardised
+class SourceError(Exception):
+    pass
+
+# This function returns the sorted paths of all supported source files matching the glob patterns
+# A file matched by more than one pattern is only returned once
+def discover_files(patterns):
+    paths = set()
+    for pattern in patterns:
+        paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.splitext(path)[1].lower() in SOURCE_FORMATS)
+    return sorted(paths)
+
+# This function opens and standardises a single source file based on its extension
+# and returns a dataframe holding only the common standardised columns
+# It runs inside the worker processes, so failures are raised as a SourceError for the main process to report
+def load_file(path):
+    open_source, normalize = SOURCE_FORMATS[os.path.splitext(path)[1].lower()]
+    try:
+        return normalize(open_source(path))[FRAME_COLUMNS]
+    except Exception as error:
+        raise SourceError(f'Incorrect file format: {path}') from error
+
+# This function opens and standardises a single source file like load_file
+# and returns the SourceError instead of raising it, so one failing file does not stop the other files of a pool
+def try_load_file(path):
+    try:
+        return load_file(path)
+    except SourceError as error:
+        return error
+
+# This function opens and standardises all the source files using a pool of at most workers processes
+# and returns the standardised dataframes in the same order as paths
+# A single file, or a single worker, is processed in the current process to avoid starting a pool
+# An already running pool can be passed in to reuse its worker processes
+# The first file that fails raises a SourceError, unless a failed list is given: failing files are then appended to it
+# and left out of the returned dataframes
+def load_files(paths, workers=None, pool=None, failed=None):
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        results = [try_load_file(path) for path in paths]
+    elif pool is not None:
+        results = list(pool.map(try_load_file, paths))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(try_load_file, paths))
+    errors = [(path, result) for path, result in zip(paths, results) if isinstance(result, SourceError)]
+    if errors and failed is None:
+        raise errors[0][1]
+    for path, error in errors:
+        failed.append(path)
+    return [result for result in results if not isinstance(result, SourceError)]
+
+# This function returns the size, modification time and SHA-256 content hash of a file
+# If the size and modification time match the previous fingerprint its hash is reused instead of reading the file again
+def file_fingerprint(path, previous=None):
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+        fingerprint['sha256'] = previous['sha256']
+        return fingerprint
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+# This function returns the manifest of processed files, mapping each path to its fingerprint
+# An empty manifest is returned if no incremental run has been completed yet
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+# This function saves the manifest of processed files
+# The file is written under a temporary name and then renamed so a failed run never leaves a partial manifest
+def save_manifest(manifest, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+# This function compares source files against the manifest
+# and returns the paths that are new or whose content changed together with their new fingerprints
+# Files that were removed or renamed since they were found are left out
+def changed_files(paths, manifest):
+    changed = []
+    fingerprints = {}
+    for path in paths:
+        key = os.path.abspath(path)
+        try:
+            fingerprint = file_fingerprint(path, manifest.get(key))
+        except FileNotFoundError:
+            continue
+        if manifest.get(key, {}).get('sha256') != fingerprint['sha256']:
+            changed.append(path)
+        fingerprints[key] = fingerprint
+    return changed, fingerprints
+
+# This function hashes transaction ids into 64 bit integers so the index of saved ids stays compact
+def hash_ids(ids):
+    return pd.util.hash_array(pd.Series(ids).dropna().astype(str).to_numpy(dtype=object))
+
+# This function returns the sorted array of hashed transaction ids saved by earlier incremental runs
+def load_seen_ids(path):
+    if not os.path.exists(path):
+        return np.array([], dtype=np.uint64)
+    return np.load(path)
+
+# This function saves the sorted array of hashed transaction ids
+def save_seen_ids(seen, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, seen)
+    os.replace(path + '.tmp', path)
+
+# This function checks which transaction ids are already in the sorted array of hashed ids
+# and returns a boolean array, missing transaction ids are never treated as seen
+def is_seen(ids, seen):
+    ids = pd.Series(ids)
+    result = np.zeros(len(ids), dtype=bool)
+    present = ids.notna().to_numpy()
+    result[present] = np.isin(hash_ids(ids[present]), seen)
+    return result
+
+# This function merges standardised dataframes from the various sources
+# and returns a single dataframe holding only the common standardised columns
+# The categories of every categorical column are first combined so the merged columns stay categorical
+def merge_sources(frames):
+    frames = [df[FRAME_COLUMNS] for df in frames]
+    dtypes = {column: pd.CategoricalDtype(pd.api.types.union_categoricals([df[column].astype('category') for df in frames]).categories)
+              for column, dtype in FRAME_SCHEMA.items() if dtype == 'category'}
+    return pd.concat([df.astype(dtypes) for df in frames], ignore_index=True)
+
+# This function splits suspicious data into a seperate dataframe so as to be easily examined
+# Every check is evaluated once and the resulting flag codes decide both the clean and flagged dataframes,
+# codes already computed by flag_codes can be passed in to avoid evaluating the checks again
+# The flags column of the flagged dataframe holds the flag codes, which are only decoded into flag reasons when the output is saved
+def split_flagged(df_final, codes=None):
+    if codes is None:
+        codes = flag_codes(df_final)
+    suspicious = codes != 0
+    df_flag = df_final[suspicious].copy()
+    df_flag['flags'] = codes[suspicious]
+    return df_final[~suspicious].copy(), df_flag
+
+# This function converts all the amount values in the clean dataframe to USD
+# The rates are looked up for all rows at once by lookup_rates, from provider and as historical rates when historical is set,
+# and applied in a single division
+def convert_to_usd(df_final, provider=None, historical=None):
+    df_final['amount'] = df_final['amount'].to_numpy(dtype=float) / lookup_rates(df_final['timestamp'], df_final['currency'], provider, historical)
+    df_final['currency'] = pd.Series('USD', index=df_final.index, dtype='category')
+    return df_final
+
+# This function saves clean and flagged dataframes to seperate CSV files for use by analyst
+# With mode 'w' the files are overwritten with a header row, with mode 'a' the rows are appended without a header
+# The files are saved to CLEAN_PATH and FLAGGED_PATH unless other paths are given
+def save_outputs(df_final, df_flag, mode='w', clean_path=None, flagged_path=None):
+    header = mode == 'w'
+    render_output(df_flag).assign(flags=decode_flags(df_flag['flags'])).to_csv(flagged_path or FLAGGED_PATH, index=False, mode=mode, header=header)
+    render_output(df_final).to_csv(clean_path or CLEAN_PATH, index=False, mode=mode, header=header)
+
+# This function renders standardised rows in the output layout of OUTPUT_COLUMNS followed by any extra columns
+# Customer ids are written as 'C-' followed by the id, or 'C--1' when the id is missing,
+# and the UTC timestamp is split into date and time strings. A date that was not valid is replaced by the raw timestamp,
+# as is a time that was not valid when the date was, so the raw value is shown once for every row with an invalid part
+# The timestamps are rendered as fixed width ISO 8601 strings in one vectorized pass and their characters are split
+# into the date and time parts without any per row Python string handling
+def render_output(df):
+    customer_id = 'C-' + df['customer_id'].astype('string').fillna('-1')
+    seconds = pd.to_datetime(df['timestamp'], utc=True).to_numpy(dtype='datetime64[ns]').astype('datetime64[s]')
+    chars = np.datetime_as_string(seconds, unit='s').astype('<U19').view(np.uint32).reshape(len(seconds), 19)
+    date = pd.Series(np.ascontiguousarray(chars[:, :10]).view('<U10').ravel(), index=df.index, dtype=object)
+    time = pd.Series(np.ascontiguousarray(chars[:, 11:]).view('<U8').ravel(), index=df.index, dtype=object) + '+00:00'
+    date_valid, time_valid = df['date_valid'].astype(bool), df['time_valid'].astype(bool)
+    date = date.where(date_valid, df['timestamp_raw'])
+    time = time.where(time_valid, df['timestamp_raw'].where(date_valid))
+    extra = [column for column in df.columns if column not in FRAME_COLUMNS]
+    return df.assign(customer_id=customer_id, date=date, time=time)[OUTPUT_COLUMNS + extra]
+
+# This function sums standardised rows into partial daily aggregates keyed by AGGREGATE_KEYS
+# df_clean holds the clean rows after their amounts were converted to USD and original holds their amounts and currencies
+# from before the conversion, df_flag holds the flagged rows with their flag codes
+# and returns one row per key with the clean count, original and USD totals, USD minimum and maximum, flagged count
+# and the number of flagged rows for every reason. Flagged rows without a valid date or other key are kept under an empty key
+def daily_aggregates(df_clean, original, df_flag):
+    # The UTC day of every row is taken straight from the timestamps, it is only rendered as text once the rows are summed
+    def keys(df, currency):
+        day = df['timestamp'].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+        day[~df['date_valid'].to_numpy(dtype=bool)] = np.datetime64('NaT')
+        return {'date': day, 'source_id': df['source_id'].to_numpy(dtype=object), 'currency': currency.to_numpy(dtype=object),
+                'payment_method': df['payment_method'].to_numpy(dtype=object)}
+    clean = pd.DataFrame({**keys(df_clean, original['currency']), 'amount': original['amount'].to_numpy(dtype=float), 'usd': df_clean['amount'].to_numpy(dtype=float)})
+    clean = clean.groupby(AGGREGATE_KEYS, dropna=False).agg(clean_count=('usd', 'size'), amount_sum=('amount', 'sum'), usd_sum=('usd', 'sum'),
+                                                             usd_min=('usd', 'min'), usd_max=('usd', 'max'))
+    codes = df_flag['flags'].to_numpy()
+    reasons = {column: (codes >> bit & 1).astype(np.int64) for bit, column in enumerate(AGGREGATE_REASON_COLUMNS)}
+    flagged = pd.DataFrame({**keys(df_flag, df_flag['currency']), 'flagged_count': np.ones(len(df_flag), dtype=np.int64), **reasons})
+    flagged = flagged.groupby(AGGREGATE_KEYS, dropna=False).sum()
+    partial = merge_aggregates([clean.reset_index(), flagged.reset_index()])
+    partial['date'] = pd.to_datetime(partial['date']).dt.strftime('%Y-%m-%d')
+    return partial
+
+# This function merges partial daily aggregates that may share keys
+# and returns a single aggregate dataframe with one row per key, in AGGREGATE_COLUMNS order and sorted by key
+def merge_aggregates(frames):
+    df = pd.concat([frame for frame in frames if len(frame)], ignore_index=True) if any(len(frame) for frame in frames) else pd.DataFrame(columns=AGGREGATE_COLUMNS)
+    df = df.reindex(columns=AGGREGATE_COLUMNS)
+    counts = ['clean_count', 'flagged_count'] + AGGREGATE_REASON_COLUMNS
+    df[counts] = df[counts].fillna(0).astype(np.int64)
+    rules = {column: 'sum' for column in AGGREGATE_COLUMNS if column not in AGGREGATE_KEYS}
+    rules.update(usd_min='min', usd_max='max')
+    # Sums of keys without clean rows stay 0 while their minimum and maximum stay empty
+    return df.groupby(AGGREGATE_KEYS, dropna=False, sort=True).agg(rules).reset_index()[AGGREGATE_COLUMNS]
+
+# This function returns the daily aggregates saved at path, or an empty aggregate dataframe if none have been saved yet
+def load_aggregates(path=None):
+    path = path or AGGREGATES_PATH
+    if not os.path.exists(path):
+        return merge_aggregates([])
+    return pd.read_csv(path, dtype={key: object for key in AGGREGATE_KEYS})
+
+# This function saves partial daily aggregates to the aggregate store at path
+# With mode 'w' the store is replaced by the partial aggregates, with mode 'a' they are merged into the saved aggregates
+# The file is written under a temporary name and then renamed so a failed run never leaves a partial store
+def save_aggregates(partial, path, mode='w'):
+    if mode == 'a':
+        partial = merge_aggregates([load_aggregates(path), partial])
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+# This function reads the daily aggregate store for dashboards and analysts
+# and returns the aggregates summed over every key not listed in by (any of AGGREGATE_KEYS, all of them by default),
+# limited to the dates from start to end (inclusive, as YYYY-MM-DD strings) and to rows whose key columns match filters,
+# where each filter is a single value or a list of values (e.g. source_id='online' or currency=['EUR', 'GBP'])
+def query_aggregates(by=None, start=None, end=None, path=None, **filters):
+    by = list(AGGREGATE_KEYS if by is None else by)
+    unknown = sorted(set(by) - set(AGGREGATE_KEYS) | set(filters) - set(AGGREGATE_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown aggregate keys: {', '.join(unknown)}")
+    df = load_aggregates(path)
+    if start is not None:
+        df = df[df['date'] >= start]
+    if end is not None:
+        df = df[df['date'] <= end]
+    for key, values in filters.items():
+        df = df[df[key].isin(values if isinstance(values, (list, tuple, set)) else [values])]
+    merged = merge_aggregates([df.assign(**{key: np.nan for key in AGGREGATE_KEYS if key not in by})])
+    return merged[by + [column for column in AGGREGATE_COLUMNS if column not in AGGREGATE_KEYS]]
+
+# This function prints a dataframe followed by a divider for quick analysis or debugging
+def show(df):
+    print(df)
     print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
-if CURRENCY_PRINT_FLAG:
-    print(current_prices)
 
 
-# Final section saves clean and flagged dataframes to seperate CSV files for use by analyst
-# if the section encounters an error the program displays an error message before exiting with an error code
-try:
-    df_flag.to_csv('./output/FlaggedEntries.csv', index=False)
-    df_final.to_csv('./output/CleanEntries.csv', index=False)
-except:
-    print("ERROR: Failed to save clean and flagged dataframe as csv")
-    exit(1)
\ No newline at end of file
+# This function returns the CPU time used so far by this process and its finished worker processes in seconds
+def cpu_time():
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+# This function returns the highest resident memory use of this process so far in megabytes
+# or None on platforms without the resource module
+def max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in bytes on macOS and in kilobytes everywhere else
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+# This class collects the metrics of a single run of the cleaning process
+# Every stage records its wall time, CPU time, rows in and out and the memory high-water mark after it finished,
+# stages that run more than once (such as once per chunk) are added together
+# The metrics are saved as a JSON file in metrics_dir, setting metrics_dir to None disables saving them
+# If profile_stage names a stage it is profiled with cProfile or tracemalloc depending on profile_mode,
+# and the profile is saved next to the metrics file
+class RunMetrics:
+    def __init__(self, mode, metrics_dir=METRICS_DIR, profile_stage=PROFILE_STAGE, profile_mode=PROFILE_MODE):
+        self.mode = mode
+        self.metrics_dir = metrics_dir
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.run_id = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        self.started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.wall = time.perf_counter()
+        self.cpu = cpu_time()
+        self.stages = {}
+        self.flags = dict.fromkeys(ALL_FLAG_REASONS, 0)
+        self.rows = {'clean': 0, 'flagged': 0}
+        self.profiler = None
+
+    # This function measures the stage run inside the with block
+    # The yielded dictionary can be used to set the rows_in and rows_out of the stage
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        record = {'rows_in': rows_in, 'rows_out': None}
+        profiling = name == self.profile_stage
+        if profiling:
+            self.start_profile()
+        wall, cpu = time.perf_counter(), cpu_time()
+        try:
+            yield record
+        finally:
+            wall, cpu = time.perf_counter() - wall, cpu_time() - cpu
+            if profiling:
+                self.stop_profile(name)
+            totals = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows_in': 0, 'rows_out': 0})
+            totals['calls'] += 1
+            totals['wall_s'] += wall
+            totals['cpu_s'] += cpu
+            totals['rows_in'] += record['rows_in'] or 0
+            totals['rows_out'] += record['rows_out'] or 0
+            totals['max_rss_mb'] = max_rss_mb()
+
+    # This generator yields the items of an iterable, measuring the time spent producing each item as a stage
+    # It is used to time loading chunk by chunk when the chunks are read lazily
+    def iter_stage(self, name, items):
+        items = iter(items)
+        while True:
+            with self.stage(name) as record:
+                item = next(items, None)
+                record['rows_out'] = 0 if item is None else len(item)
+            if item is None:
+                return
+            yield item
+
+    # This function adds the number of rows flagged for every reason in an array of flag codes to the metrics
+    # and returns the number of rows with at least one flag
+    def count_flags(self, codes):
+        codes = np.asarray(codes)
+        for bit, reason in enumerate(ALL_FLAG_REASONS):
+            self.flags[reason] += int(np.count_nonzero(codes & (1 << bit)))
+        return int(np.count_nonzero(codes))
+
+    # This function starts profiling the profiled stage
+    def start_profile(self):
+        if self.profile_mode == 'tracemalloc':
+            tracemalloc.start(25)
+        else:
+            self.profiler = self.profiler or cProfile.Profile()
+            self.profiler.enable()
+
+    # This function stops profiling the profiled stage
+    # A tracemalloc profile is saved straight away listing the lines that allocated the most memory
+    def stop_profile(self, name):
+        if self.profile_mode == 'tracemalloc':
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if self.metrics_dir is not None:
+                os.makedirs(self.metrics_dir, exist_ok=True)
+                with open(os.path.join(self.metrics_dir, f'profile_{name}_{self.run_id}.txt'), 'w', encoding='utf-8') as f:
+                    f.write(f'peak traced memory: {peak / 2**20:.1f} MB\n')
+                    for stat in snapshot.statistics('lineno')[:30]:
+                        f.write(f'{stat}\n')
+        else:
+            self.profiler.disable()
+
+    # This function saves the metrics of the run as a JSON file
+    # and returns the path of the file, or None if saving metrics is disabled
+    def save(self, status='ok', error=None):
+        if self.metrics_dir is None:
+            return None
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        if self.profiler is not None:
+            self.profiler.dump_stats(os.path.join(self.metrics_dir, f'profile_{self.profile_stage}_{self.run_id}.prof'))
+        path = os.path.join(self.metrics_dir, f'metrics_{self.run_id}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'run_id': self.run_id,
+                'mode': self.mode,
+                'status': status,
+                'error': error,
+                'started_at': self.started_at,
+                'wall_s': time.perf_counter() - self.wall,
+                'cpu_s': cpu_time() - self.cpu,
+                'max_rss_mb': max_rss_mb(),
+                'rows': self.rows,
+                'flags': self.flags,
+                'stages': self.stages,
+            }, f, indent=1)
+        return path
+
+    # This function saves the metrics of the failed run and raises a PipelineError with the error message
+    def fail(self, message):
+        try:
+            self.save('failed', message)
+        except OSError:
+            pass
+        raise PipelineError(message)
+
+# Raised when a section of the cleaning process fails, main displays its message and exits with an error code
+class PipelineError(Exception):
+    pass
+
+
+# This function runs the whole cleaning process over all the data loaded into memory at once
+# and returns the metrics of the run
+# if a section encounters an error its metrics are saved and a PipelineError is raised
+def run_batch(config):
+    metrics = RunMetrics('batch', config['metrics_dir'], config['profile_stage'], config['profile_mode'])
+    sources = [('JSON', config['json_path'], open_json, normalize_json, config['json_print_flag']),
+               ('CSV', config['csv_path'], open_csv, normalize_csv, config['csv_print_flag']),
+               ('XML', config['xml_path'], open_xml, normalize_xml, config['xml_print_flag'])]
+    frames = []
+    for name, path, open_source, normalize, print_flag in sources:
+        # This section cleans and standardise the columns from the source file
+        try:
+            with metrics.stage('load') as record:
+                df = open_source(path)
+                record['rows_out'] = len(df)
+            with metrics.stage('normalize', len(df)) as record:
+                df = normalize(df)
+                record['rows_out'] = len(df)
+        except:
+            metrics.fail(f"Incorrect {name} file format")
+        frames.append(df)
+
+    # This section merges the now standardised data from the various sources
+    try:
+        with metrics.stage('merge', sum(len(df) for df in frames)) as record:
+            df_final = merge_sources(frames)
+            record['rows_out'] = len(df_final)
+    except:
+        metrics.fail("Failed to merge dataframes")
+
+    # This section uses flags set initially to determine which source dataframes to display for quick analysis or debugging
+    # Default all print flags set to False
+    for (name, path, open_source, normalize, print_flag), df in zip(sources, frames):
+        if print_flag:
+            show(df)
+
+    duplicates = open_duplicate_index(config, metrics)
+    process_merged(df_final, metrics, config, duplicates=duplicates)
+    save_duplicate_index(duplicates, config, metrics)
+    if config['currency_print_flag']:
+        print(get_rates(config['rate_provider']))
+    metrics.save()
+    return metrics
+
+# This function flags, converts and saves the merged data from all sources, recording every stage in metrics
+# mode is passed on to save_outputs, so 'a' appends to the existing output files
+# Duplicates are found with the duplicates index, which holds the rows of earlier chunks, batches or runs,
+# a new empty index is used when none is given. The rows are only added to the index once they and their daily totals are saved
+# if a section encounters an error its metrics are saved and a PipelineError is raised
+def process_merged(df_final, metrics, config, mode='w', duplicates=None):
+    duplicates = duplicates or DuplicateIndex()
+    # This section loads the exchange rates needed to check currencies and convert amounts
+    try:
+        with metrics.stage('rates'):
+            get_rates(config['rate_provider'])
+    except RateError:
+        metrics.fail("Unable to load API")
+
+    # This section collects suspicious data into a seperate flagged dataframe
+    try:
+        with metrics.stage('flag', len(df_final)) as record:
+            codes = flag_codes(df_final, config['rate_provider'])
+            record['rows_out'] = int(np.count_nonzero(codes))
+        with metrics.stage('duplicates', len(df_final)) as record:
+            repeated = duplicates.check(df_final, config['duplicate_window'])
+            codes[repeated] |= DUPLICATE_BIT
+            record['rows_out'] = int(np.count_nonzero(repeated))
+        metrics.count_flags(codes)
+        with metrics.stage('split', len(df_final)) as record:
+            df_final, df_flag = split_flagged(df_final, codes)
+            record['rows_out'] = len(df_final) + len(df_flag)
+    except:
+        metrics.fail("Failed to create flagged output dataframe")
+    metrics.rows['clean'] += len(df_final)
+    metrics.rows['flagged'] += len(df_flag)
+
+    # This section converts all the amount values in the clean dataframe to USD
+    # The original amounts and currencies are kept for the aggregate store
+    original = df_final[['amount', 'currency']].copy()
+    try:
+        with metrics.stage('convert', len(df_final)) as record:
+            df_final = convert_to_usd(df_final, config['rate_provider'], config['historical_rates_flag'])
+            record['rows_out'] = len(df_final)
+    except:
+        metrics.fail("Failed to convert values to USD")
+
+    # This section uses flags set initially to determine which output dataframes to display for quick analysis or debugging
+    # Default all print flags set to False
+    if config['flagged_print_flag']:
+        show(df_flag)
+    if config['final_print_flag']:
+        show(df_final)
+
+    # Final section saves clean and flagged dataframes to seperate CSV files for use by analyst
+    try:
+        with metrics.stage('write', len(df_final) + len(df_flag)) as record:
+            save_outputs(df_final, df_flag, mode, config['clean_path'], config['flagged_path'])
+            record['rows_out'] = len(df_final) + len(df_flag)
+    except:
+        metrics.fail("Failed to save clean and flagged dataframe as csv")
+
+    # This section merges the daily totals of the saved rows into the aggregate store
+    if config['aggregates_path']:
+        try:
+            with metrics.stage('aggregate', len(df_final) + len(df_flag)) as record:
+                partial = daily_aggregates(df_final, original, df_flag)
+                save_aggregates(partial, config['aggregates_path'], mode)
+                record['rows_out'] = len(partial)
+        except:
+            metrics.fail("Failed to update the aggregate store")
+    duplicates.commit()
+    duplicates.prune(config['duplicate_index_days'])
+
+# This function returns the duplicate index of a run, which is loaded from the duplicate_index_path setting
+# when the duplicate_index_flag setting is set and starts empty otherwise
+# if loading fails its metrics are saved and a PipelineError is raised
+def open_duplicate_index(config, metrics):
+    if not config['duplicate_index_flag']:
+        return DuplicateIndex()
+    try:
+        return DuplicateIndex.load(config['duplicate_index_path'])
+    except:
+        metrics.fail("Failed to load duplicate index")
+
+# This function saves the duplicate index of a run when the duplicate_index_flag setting is set
+# if saving fails its metrics are saved and a PipelineError is raised
+def save_duplicate_index(duplicates, config, metrics):
+    if not config['duplicate_index_flag']:
+        return
+    try:
+        duplicates.save(config['duplicate_index_path'], config['duplicate_index_days'])
+    except:
+        metrics.fail("Failed to save duplicate index")
+
+# This function opens, standardises, merges, flags, converts and saves the source files in paths, recording every stage in metrics
+# The files are opened and standardised in parallel by a pool of worker processes, or by pool when one is given
+# Rows whose transaction id is in the sorted array of hashed ids seen are skipped when seen is given
+# and duplicates are found with the duplicates index as in process_merged
+# When a failed list is given, files that can not be opened or standardised are appended to it and the other files are still saved
+# and returns the transaction ids of the saved rows
+# if a section encounters an error its metrics are saved and a PipelineError is raised
+def process_files(paths, metrics, config, mode='w', seen=None, pool=None, duplicates=None, failed=None):
+    # This section opens and standardises every source file in parallel
+    try:
+        with metrics.stage('load') as record:
+            frames = load_files(paths, config['workers'], pool, failed)
+            record['rows_out'] = sum(len(df) for df in frames)
+    except SourceError as error:
+        metrics.fail(str(error))
+    paths = [path for path in paths if path not in (failed or [])]
+
+    # This section merges the now standardised data from the various files, there may be none left when every file failed
+    try:
+        with metrics.stage('merge', sum(len(df) for df in frames)) as record:
+            df_final = merge_sources(frames) if frames else enforce_schema(pd.DataFrame(columns=FRAME_COLUMNS))
+            record['rows_out'] = len(df_final)
+    except:
+        metrics.fail("Failed to merge dataframes")
+
+    # This section uses flags set initially to determine which source dataframes to display for quick analysis or debugging
+    print_flags = {'.json': config['json_print_flag'], '.csv': config['csv_print_flag'], '.xml': config['xml_print_flag']}
+    for path, df in zip(paths, frames):
+        if print_flags[os.path.splitext(path)[1].lower()]:
+            show(df)
+
+    # This section skips rows whose transaction id was already saved by an earlier run
+    if seen is not None:
+        with metrics.stage('skip_seen', len(df_final)) as record:
+            df_final = df_final[~is_seen(df_final['transaction_id'], seen)]
+            record['rows_out'] = len(df_final)
+
+    process_merged(df_final, metrics, config, mode, duplicates)
+    return df_final['transaction_id']
+
+# This function records the fingerprints of the processed files and the saved transaction ids for the next run
+# and returns the updated sorted array of hashed ids
+# Saving the manifest completes the batch started by begin_batch. The ids are saved after it, since ids saved for a batch
+# that is later undone would skip its rows for good, while recover_batch adds the ids of a completed batch again if they are missing
+# if saving fails its metrics are saved and a PipelineError is raised
+def save_state(seen, ids, manifest, fingerprints, metrics, config):
+    try:
+        save_manifest({**manifest, **fingerprints}, config['manifest_path'])
+        manifest.update(fingerprints)
+        seen = np.union1d(seen, hash_ids(ids))
+        save_seen_ids(seen, config['seen_ids_path'])
+    except:
+        metrics.fail("Failed to save incremental state")
+    return seen
+
+# This function returns the path of the file describing the batch an incremental or watch run is saving, next to the manifest
+def pending_path(config):
+    return os.path.splitext(config['manifest_path'])[0] + '_pending.json'
+
+# This function records how the outputs looked before a batch of an incremental or watch run is saved to them
+# The sizes of the output files (None when mode 'w' replaces them), a copy of the aggregate store and the fingerprints
+# of the batch's files are saved, so recover_batch can undo the batch if the run stops before the manifest is saved
+# if saving fails its metrics are saved and a PipelineError is raised
+def begin_batch(fingerprints, mode, metrics, config):
+    try:
+        outputs = {path: os.path.getsize(path) if mode == 'a' else None for path in (config['clean_path'], config['flagged_path'])}
+        aggregates = config['aggregates_path']
+        backup = None
+        if aggregates and mode == 'a' and os.path.exists(aggregates):
+            backup = aggregates + '.pending'
+            shutil.copyfile(aggregates, backup)
+        path = pending_path(config)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'outputs': outputs, 'aggregates': aggregates, 'backup': backup, 'fingerprints': fingerprints}, f, indent=1)
+        os.replace(path + '.tmp', path)
+    except:
+        metrics.fail("Failed to save pending batch")
+
+# This function removes the record of a batch once its outputs and state are saved
+def finish_batch(config):
+    path = pending_path(config)
+    with open(path, encoding='utf-8') as f:
+        backup = json.load(f)['backup']
+    if backup and os.path.exists(backup):
+        os.remove(backup)
+    os.remove(path)
+
+# This function returns the transaction ids of the rows an output file gained after its first size bytes,
+# or of all its rows when size is None
+def appended_ids(path, size):
+    if not os.path.exists(path) or size is not None and os.path.getsize(path) <= size:
+        return pd.Series([], dtype=object)
+    if size is None:
+        return pd.read_csv(path, usecols=['transaction_id'], dtype=str)['transaction_id']
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    with open(path, 'rb') as f:
+        f.seek(size)
+        return pd.read_csv(f, header=None, names=columns, usecols=['transaction_id'], dtype=str)['transaction_id']
+
+# This function completes or undoes the batch an earlier run left unfinished, if there is one
+# and returns the updated sorted array of hashed ids
+# A batch whose files are all in the manifest was saved, only the ids of the rows it appended may be missing from seen.
+# Any other batch is undone by truncating the output files to their earlier sizes (removing them if the batch created them)
+# and restoring the copy of the aggregate store, so processing its files again never saves their rows twice
+def recover_batch(manifest, seen, config):
+    path = pending_path(config)
+    if not os.path.exists(path):
+        return seen
+    with open(path, encoding='utf-8') as f:
+        pending = json.load(f)
+    if all(manifest.get(key, {}).get('sha256') == fingerprint['sha256'] for key, fingerprint in pending['fingerprints'].items()):
+        ids = pd.concat([appended_ids(output, size) for output, size in pending['outputs'].items()])
+        seen = np.union1d(seen, hash_ids(ids))
+        save_seen_ids(seen, config['seen_ids_path'])
+    else:
+        for output, size in pending['outputs'].items():
+            if size is None and os.path.exists(output):
+                os.remove(output)
+            elif size is not None and os.path.exists(output):
+                os.truncate(output, size)
+        if pending['backup']:
+            os.replace(pending['backup'], pending['aggregates'])
+        elif pending['aggregates'] and os.path.exists(pending['aggregates']):
+            os.remove(pending['aggregates'])
+    finish_batch(config)
+    return seen
+
+# This function runs the cleaning process over every source file matching the source_globs setting
+# and returns the metrics of the run
+# The files are opened and standardised in parallel by a pool of worker processes before being merged in path order,
+# so the load stage of its metrics also covers standardising the files
+# The source print flags display every standardised file of the matching format
+# With the incremental_flag setting only new or changed files are processed and rows with already saved transaction ids are skipped
+# if a section encounters an error its metrics are saved and a PipelineError is raised
+def run_directory(config):
+    incremental = config['incremental_flag']
+    metrics = RunMetrics('incremental' if incremental else 'directory', config['metrics_dir'], config['profile_stage'], config['profile_mode'])
+
+    # This section finds the source files to process
+    paths = discover_files(config['source_globs'])
+    if not paths:
+        metrics.fail("No source files found")
+
+    # This section skips source files that were already processed by an earlier incremental run
+    mode = 'w'
+    if incremental:
+        try:
+            manifest = load_manifest(config['manifest_path'])
+            seen = recover_batch(manifest, load_seen_ids(config['seen_ids_path']), config)
+            paths, fingerprints = changed_files(paths, manifest)
+        except:
+            metrics.fail("Failed to load incremental state")
+        if not paths:
+            print("No new or changed source files to process")
+            metrics.save()
+            return metrics
+        # Outputs are only appended to once an earlier incremental run has written them
+        if manifest and os.path.exists(config['clean_path']) and os.path.exists(config['flagged_path']):
+            mode = 'a'
+
+    duplicates = open_duplicate_index(config, metrics)
+    if incremental:
+        begin_batch(fingerprints, mode, metrics, config)
+    ids = process_files(paths, metrics, config, mode, seen if incremental else None, duplicates=duplicates)
+
+    # This section records the processed files and saved transaction ids for the next incremental run
+    if incremental:
+        save_state(seen, ids, manifest, fingerprints, metrics, config)
+    save_duplicate_index(duplicates, config, metrics)
+    if incremental:
+        finish_batch(config)
+
+    if config['currency_print_flag']:
+        print(get_rates(config['rate_provider']))
+    metrics.save()
+    return metrics
+
+# This function runs the cleaning process one chunk of at most chunk_size records at a time
+# and returns the metrics of the run
+# Each chunk is standardised, flagged and converted on its own before being appended to the output files,
+# so peak memory use is governed by the chunk size instead of the size of the source files
+# The print flags display every chunk of the matching source or output as it is processed
+# if a section encounters an error its metrics are saved and a PipelineError is raised
+def run_stream(config):
+    metrics = RunMetrics('stream', config['metrics_dir'], config['profile_stage'], config['profile_mode'])
+
+    # This section creates both output files containing only their header rows and an empty aggregate store
+    try:
+        empty = enforce_schema(pd.DataFrame(columns=FRAME_COLUMNS))
+        save_outputs(empty, empty.assign(flags=np.array([], dtype=np.uint16)), 'w', config['clean_path'], config['flagged_path'])
+        if config['aggregates_path']:
+            save_aggregates(merge_aggregates([]), config['aggregates_path'])
+    except:
+        metrics.fail("Failed to save clean and flagged dataframe as csv")
+
+    # Every chunk is checked for duplicates of the rows in all chunks before it
+    duplicates = open_duplicate_index(config, metrics)
+    chunk_size = config['chunk_size']
+    sources = [('JSON', open_json(config['json_path'], chunk_size), normalize_json, config['json_print_flag']),
+               ('CSV', open_csv(config['csv_path'], chunk_size), normalize_csv, config['csv_print_flag']),
+               ('XML', open_xml(config['xml_path'], chunk_size), normalize_xml, config['xml_print_flag'])]
+    for name, chunks, normalize, print_flag in sources:
+        # This section standardises every chunk of a source in turn before it is flagged, converted and saved
+        try:
+            for chunk in metrics.iter_stage('load', chunks):
+                with metrics.stage('normalize', len(chunk)) as record:
+                    chunk = normalize(chunk)
+                    record['rows_out'] = len(chunk)
+                if print_flag:
+                    show(chunk)
+                with metrics.stage('merge', len(chunk)) as record:
+                    df_final = merge_sources([chunk])
+                    record['rows_out'] = len(df_final)
+                process_merged(df_final, metrics, config, 'a', duplicates)
+        except PipelineError:
+            raise
+        except:
+            metrics.fail(f"Failed to process chunks from the {name} file")
+    save_duplicate_index(duplicates, config, metrics)
+
+    if config['currency_print_flag']:
+        print(get_rates(config['rate_provider']))
+    metrics.save()
+    return metrics
+
+# This function checks the source globs for new or changed files every interval seconds until stop is set
+# and puts the path of every file that needs processing on the files queue
+# A file is only queued once its size and modification time stayed the same since the previous check, so files still being
+# written are left alone, and files whose size and modification time match the manifest or the time they were queued are skipped
+# The queue is bounded, so while it is full the watcher waits instead of looking for more files
+# queued maps the absolute path of every queued file to its size and modification time, removing a path queues it again
+def watch_files(patterns, manifest, files, stop, interval, queued=None):
+    previous = {}
+    queued = {} if queued is None else queued
+    while not stop.is_set():
+        for path in discover_files(patterns):
+            key = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            current = (stat.st_size, stat.st_mtime)
+            settled = previous.get(key) == current
+            previous[key] = current
+            entry = manifest.get(key)
+            if not settled or queued.get(key) == current or entry and (entry['size'], entry['mtime']) == current:
+                continue
+            while not stop.is_set():
+                try:
+                    files.put(path, timeout=interval)
+                    queued[key] = current
+                    break
+                except queue.Full:
+                    pass
+        stop.wait(interval)
+
+# This function collects the next micro-batch of at most max_files paths from the files queue
+# and returns the paths, the batch is closed window seconds after its first path arrived
+# Once stop is set the paths already queued are returned straight away without waiting, an empty list means none were left
+def next_batch(files, stop, max_files, window):
+    batch = []
+    deadline = None
+    while len(batch) < max_files:
+        if stop.is_set():
+            timeout = 0
+        elif deadline is None:
+            timeout = 0.5
+        else:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+        try:
+            batch.append(files.get(timeout=timeout) if timeout else files.get_nowait())
+        except queue.Empty:
+            if stop.is_set():
+                break
+            continue
+        if deadline is None:
+            deadline = time.monotonic() + window
+    return batch
+
+# This function keeps running the cleaning process over new or changed source files matching the source_globs setting
+# until stop is set, or until the process receives SIGINT or SIGTERM when it is running in the main thread
+# and returns the number of micro-batches processed
+# A watcher thread queues files as they arrive and every micro-batch is processed like an incremental run, saving its own metrics,
+# while the exchange rates, the duplicate index and the pool of worker processes are kept between batches
+# On shutdown the files already queued are processed before returning, files that were never queued are found by the next run
+# A failing batch is undone by recover_batch and reported without stopping the watcher, its files are not recorded and are queued again
+# Files that can not be opened or standardised are recorded as failed in the manifest, so they are skipped until they change
+def run_watch(config, stop=None):
+    stop = stop or threading.Event()
+    try:
+        manifest = load_manifest(config['manifest_path'])
+        seen = recover_batch(manifest, load_seen_ids(config['seen_ids_path']), config)
+        duplicates = DuplicateIndex.load(config['duplicate_index_path']) if config['duplicate_index_flag'] else DuplicateIndex()
+    except:
+        raise PipelineError("Failed to load incremental state")
+    # Outputs are only appended to once an earlier run has written them
+    mode = 'a' if manifest and os.path.exists(config['clean_path']) and os.path.exists(config['flagged_path']) else 'w'
+
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, lambda signum, frame: stop.set())
+    files = queue.Queue(maxsize=config['watch_queue_size'])
+    queued = {}
+    watcher = threading.Thread(target=watch_files, args=(config['source_globs'], manifest, files, stop, config['watch_interval'], queued), daemon=True)
+    workers = config['workers'] or os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=workers)
+        # The worker processes are started before the watcher thread so they are never forked while it is running
+        pool.submit(os.getpid).result()
+    batches = 0
+    watcher.start()
+    try:
+        while True:
+            batch = next_batch(files, stop, config['watch_batch_files'], config['watch_batch_seconds'])
+            if not batch:
+                # The watcher may queue one last file while stopping, so the queue is only done once the watcher finished
+                if stop.is_set():
+                    watcher.join()
+                    if files.empty():
+                        break
+                continue
+            metrics = RunMetrics('watch', config['metrics_dir'], config['profile_stage'], config['profile_mode'])
+            # The duplicate index is put back as it was if the batch fails, so processing its files again does not match their own rows
+            index = duplicates.keys, duplicates.times, duplicates.ids, duplicates.id_times
+            # Files of a failed batch, and files that disappeared before they were processed, are queued again once they are found
+            try:
+                paths, fingerprints = changed_files(batch, manifest)
+                retry = [path for path in batch if os.path.abspath(path) not in fingerprints]
+                if paths:
+                    begin_batch(fingerprints, mode, metrics, config)
+                    failed = []
+                    ids = process_files(paths, metrics, config, mode, seen, pool, duplicates, failed)
+                    # Files that can not be opened are recorded as failed, so they are only tried again once they change
+                    for path in failed:
+                        print(f"ERROR: Incorrect file format: {path}, skipped until it changes")
+                        fingerprints[os.path.abspath(path)]['failed'] = True
+                    seen = save_state(seen, ids, manifest, fingerprints, metrics, config)
+                    mode = 'a'
+                    save_duplicate_index(duplicates, config, metrics)
+                    finish_batch(config)
+                metrics.save()
+            except Exception as error:
+                print(f"ERROR: {error}" if isinstance(error, PipelineError) else f"ERROR: Failed to process {len(batch)} source files: {error}")
+                duplicates.keys, duplicates.times, duplicates.ids, duplicates.id_times = index
+                retry = batch
+                seen = recover_batch(manifest, seen, config)
+            for path in retry:
+                queued.pop(os.path.abspath(path), None)
+            batches += 1
+    finally:
+        stop.set()
+        if pool is not None:
+            pool.shutdown()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return batches
+
+# This function returns the settings of a run as a dictionary holding the current value of every constant in CONFIG_KEYS
+def default_config():
+    return {key: globals()[key.upper()] for key in CONFIG_KEYS}
+
+# This function runs the cleaning process in the current process with the settings in config
+# and returns the metrics of the run
+# config is a dictionary overriding any of the settings in CONFIG_KEYS, settings it leaves out use their module constant
+# The rate_provider setting takes a RateProvider (e.g. over a StaticBackend) used for every exchange rate of the run
+# The run is done in watch mode if watch_flag is set, in directory mode if directory_flag or incremental_flag is set,
+# otherwise in stream mode if stream_flag is set. Watch mode runs until it is stopped and returns the number of micro-batches instead
+# A ValueError is raised for unknown settings and a PipelineError is raised if a section of the run fails
+def run_pipeline(config=None):
+    config = config or {}
+    unknown = sorted(set(config) - set(CONFIG_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(unknown)}")
+    config = {**default_config(), **config}
+    if config['watch_flag']:
+        return run_watch(config)
+    if config['directory_flag'] or config['incremental_flag']:
+        return run_directory(config)
+    if config['stream_flag']:
+        return run_stream(config)
+    return run_batch(config)
+
+# This function reads the settings of a run from the command line arguments (sys.argv when argv is None)
+# and returns them as a config dictionary holding only the settings that were given
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Clean, flag and convert the JSON, CSV and XML transaction sources')
+    parser.add_argument('--json', dest='json_path', help='path of the JSON source file')
+    parser.add_argument('--csv', dest='csv_path', help='path of the CSV source file')
+    parser.add_argument('--xml', dest='xml_path', help='path of the XML source file')
+    parser.add_argument('--clean', dest='clean_path', help='path of the clean output CSV file')
+    parser.add_argument('--flagged', dest='flagged_path', help='path of the flagged output CSV file')
+    parser.add_argument('--aggregates', dest='aggregates_path', help='path of the daily aggregate store')
+    parser.add_argument('--latest-rates', dest='historical_rates_flag', action='store_const', const=False,
+                        help="convert every transaction at the latest rates instead of the rates for its own date")
+    parser.add_argument('--print', dest='print', action='append', choices=['json', 'csv', 'xml', 'flagged', 'final', 'currency'],
+                        help='display a source or output dataframe, can be given more than once')
+    parser.add_argument('--stream', dest='stream_flag', action='store_true', default=None, help='process the sources in chunks')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, help='number of records per chunk when streaming')
+    parser.add_argument('--directory', dest='directory_flag', action='store_true', default=None, help='process every file matching the source globs')
+    parser.add_argument('--glob', dest='source_globs', action='append', help='source file pattern for directory runs, can be given more than once')
+    parser.add_argument('--workers', dest='workers', type=int, help='number of worker processes for directory runs')
+    parser.add_argument('--incremental', dest='incremental_flag', action='store_true', default=None, help='only process new or changed source files')
+    parser.add_argument('--manifest', dest='manifest_path', help='path of the manifest of processed files')
+    parser.add_argument('--seen-ids', dest='seen_ids_path', help='path of the index of saved transaction ids')
+    parser.add_argument('--watch', dest='watch_flag', action='store_true', default=None, help='keep processing new or changed source files as they arrive')
+    parser.add_argument('--watch-interval', dest='watch_interval', type=float, help='seconds between checks for new files')
+    parser.add_argument('--batch-files', dest='watch_batch_files', type=int, help='largest number of files in a micro-batch')
+    parser.add_argument('--batch-seconds', dest='watch_batch_seconds', type=float, help='seconds a micro-batch waits for more files')
+    parser.add_argument('--queue-size', dest='watch_queue_size', type=int, help='largest number of files waiting to be processed')
+    parser.add_argument('--duplicate-window', dest='duplicate_window', type=float, help='seconds within which matching transactions are duplicates')
+    parser.add_argument('--duplicate-index', dest='duplicate_index_flag', action='store_true', default=None,
+                        help='remember checked transactions between runs to find duplicates of earlier runs')
+    parser.add_argument('--duplicate-index-path', dest='duplicate_index_path', help='path of the saved duplicate index')
+    parser.add_argument('--duplicate-index-days', dest='duplicate_index_days', type=int, help='days transactions are kept in the duplicate index')
+    parser.add_argument('--metrics-dir', dest='metrics_dir', help='directory the run metrics are saved to')
+    parser.add_argument('--no-metrics', action='store_true', help='do not save run metrics')
+    parser.add_argument('--profile-stage', dest='profile_stage', help='name of a stage to profile')
+    parser.add_argument('--profile-mode', dest='profile_mode', choices=['cprofile', 'tracemalloc'], help='profiler used for the profiled stage')
+    args = vars(parser.parse_args(argv))
+    config = {key: value for key, value in args.items() if key in CONFIG_KEYS and value is not None}
+    if args['no_metrics']:
+        config['metrics_dir'] = None
+    for name in args['print'] or []:
+        config[f'{name}_print_flag'] = True
+    return config
+
+# This function is the command line entry point of the cleaning process
+# If the run fails it displays an error message before exiting the program with a error code
+def main(argv=None):
+    try:
+        run_pipeline(parse_args(argv))
+    except PipelineError as error:
+        print(f"ERROR: {error}")
+        exit(1)
+
+
+# The cleaning process only runs when the script is executed directly, importing it has no side effects
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# Imports
+import unittest
+import sys
+import os
+import tempfile
+import pandas as pd
+
+# Get the parent directory of the current file
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+# Imports scripts to be tested
+from src import script
+from benchmark import generate_data
+
+
+# Testing class
+class TestGenerateData(unittest.TestCase):
+    # Tests that the generated files can be loaded by the script in the same layout as the sample data
+    # if handled correctly every file loads into a dataframe and the rows are split over the three files
+    def test_GENERATE_FILES(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = generate_data.generate(tmp, 10)
+            frames = [script.open_json(paths[0]), script.open_csv(paths[1]), script.open_xml(paths[2])]
+            ndjson = list(script.open_json(generate_data.generate(os.path.join(tmp, 'ndjson'), 10, ndjson=True)[0], chunksize=100))
+        self.assertEqual([len(df) for df in frames], [4, 3, 3])
+        self.assertEqual(list(frames[1].columns), list(pd.read_csv(script.CSV_PATH).columns))
+        self.assertEqual(len(ndjson[0]), 4)
+    # Tests that every kind of dirty value is generated when its rate is 1
+    # Correct output flags every generated row with the matching reason
+    def test_GENERATE_DIRTY(self):
+        provider = script.RateProvider(script.StaticBackend(generate_data.FIXED_RATES), cache_dir=None)
+        reasons = {'null_customer': 'Invalid Customer ID', 'invalid_date': 'Invalid Date Value',
+                   'bad_amount': 'Invalid Amount', 'unknown_currency': 'Invalid Currency'}
+        for dirty, reason in reasons.items():
+            rates = dict.fromkeys(generate_data.DIRTY_RATES, 0.0)
+            rates[dirty] = 1.0
+            with tempfile.TemporaryDirectory() as tmp:
+                paths = generate_data.generate(tmp, 9, dirty=rates)
+                frames = [script.normalize_json(script.open_json(paths[0])), script.normalize_csv(script.open_csv(paths[1])), script.normalize_xml(script.open_xml(paths[2]))]
+            flags = script.decode_flags(script.flag_codes(script.merge_sources(frames), provider))
+            self.assertTrue(all(reason in row for row in flags), dirty)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,13 @@
 import unittest
 import sys
 import os
+import numpy as np
 import pandas as pd
+import tempfile
+import json
+import shutil
+import subprocess
+import datetime
 
 # Get the parent directory of the current file
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -11,6 +17,62 @@ sys.path.append(parent_dir)
 # Imports script to be tested
 from src import script
 
+# Fixed exchange rates used by the tests instead of the frankfurter API
+TEST_RATES = {'EUR': 0.85, 'GBP': 0.74, 'ZAR': 17.5}
+script.RATE_PROVIDER = script.RateProvider(script.StaticBackend(TEST_RATES), cache_dir=None)
+
+
+# Rate backend that counts its requests and can be switched to fail like an unreachable API
+class CountingBackend(script.StaticBackend):
+    def __init__(self, rates):
+        super().__init__(rates)
+        self.calls = 0
+        self.fail = False
+
+    def fetch(self, base, date='latest'):
+        self.calls += 1
+        if self.fail:
+            raise script.RateError('API unavailable')
+        return super().fetch(base, date)
+
+
+# Rate backend that serves a fixed time series of rates keyed by date and counts its time series requests
+# Like the frankfurter API it has no rates for single past dates outside the series, and its series can be switched to fail
+class SeriesBackend(script.StaticBackend):
+    def __init__(self, series):
+        super().__init__(series[max(series)])
+        self.series = series
+        self.calls = 0
+        self.fail = False
+
+    def fetch(self, base, date='latest'):
+        if date != 'latest':
+            raise script.RateError(f'No exchange rates on {date}')
+        return super().fetch(base, date)
+
+    def fetch_series(self, base, start, end):
+        self.calls += 1
+        if self.fail:
+            raise script.RateError('API unavailable')
+        return {'base': base, 'start_date': start, 'end_date': end, 'rates': {date: rates for date, rates in self.series.items() if start <= date <= end}}
+
+
+# HTTP session that answers every request with the next status code in statuses, repeating the last one, and counts its requests
+class StatusSession:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        status = self.statuses[min(self.calls, len(self.statuses) - 1)]
+        self.calls += 1
+        return type('Response', (), {'status_code': status, 'json': lambda self: {'rates': TEST_RATES}})()
+
+
+# This function builds standardised rows from (customer id, transaction id, timestamp, amount, currency) tuples for the duplicate tests
+def duplicate_frame(rows):
+    df = pd.DataFrame(rows, columns=['customer_id', 'transaction_id', 'timestamp', 'amount', 'currency'])
+    return script.enforce_schema(df.assign(timestamp=pd.to_datetime(df['timestamp'], utc=True), date_valid=True, time_valid=True, payment_method='card', source_id='online'))
 
 # Testing class
 class TestMain(unittest.TestCase):
@@ -46,6 +108,164 @@ class TestMain(unittest.TestCase):
         result = script.open_xml(script.XML_PATH)
         self.assertIsInstance(result, pd.DataFrame)
 
+    # Tests how script handles empty path to JSON file when streaming in chunks
+    # if handled correctly script will return -1
+    def test_JSON_File_EMPTY_CHUNKED(self):
+        result = script.open_json('', chunksize=2)
+        self.assertEqual(result, -1)
+    # Tests how script streams a JSON file containing a top level array in chunks
+    # if handled correctly script will return the same records as loading the whole file
+    def test_JSON_File_CHUNKED(self):
+        chunks = list(script.open_json(script.JSON_PATH, chunksize=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(list(pd.concat(chunks)['id']), list(script.open_json(script.JSON_PATH)['id']))
+    # Tests how script streams a newline delimited JSON file in chunks
+    # if handled correctly script will return every record
+    def test_JSON_File_NDJSON_CHUNKED(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'transactions.ndjson')
+            with open(path, 'w') as f:
+                f.write('{"id": "ON-1", "total": {"amount": 1.5}}\n{"id": "ON-2"}\n{"id": "ON-3"}\n')
+            chunks = list(script.open_json(path, chunksize=2))
+        self.assertEqual(list(pd.concat(chunks)['id']), ['ON-1', 'ON-2', 'ON-3'])
+    # Tests how script loads only the required nested fields of a JSON file
+    # if handled correctly script will return the projected columns with a missing or non object parent left empty
+    def test_JSON_File_PROJECTED(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'transactions.ndjson')
+            with open(path, 'w') as f:
+                f.write('{"id": "ON-1", "channel": "online", "customer": {"id": "C-1", "email": "a@example.com"}, "total": {"amount": "1.5", "currency": "EUR"}, "meta": {}}\n')
+                f.write('{"id": "ON-2", "customer": null, "total": "12", "payment": {"method": "card"}}\n')
+            result = script.open_json(path)
+        self.assertEqual(list(result.columns), script.JSON_COLUMNS)
+        self.assertEqual(list(result['customer_id']), ['C-1', None])
+        self.assertEqual(list(result['payment_method']), [None, 'card'])
+        self.assertEqual(result['amount'].dtype, float)
+        self.assertEqual(result['amount'].iloc[0], 1.5)
+        self.assertTrue(pd.isna(result['amount'].iloc[1]))
+    # Tests how script streams a CSV file in chunks
+    # if handled correctly script will return dataframes of at most chunksize rows
+    def test_CSV_File_CHUNKED(self):
+        chunks = list(script.open_csv(script.CSV_PATH, chunksize=4))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+    # Tests how script streams a XML file in chunks
+    # if handled correctly script will return the same transactions as loading the whole file
+    def test_XML_File_CHUNKED(self):
+        chunks = list(script.open_xml(script.XML_PATH, chunksize=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), script.open_xml(script.XML_PATH))
+    # Tests how script reads a XML file when lxml is not installed
+    # if handled correctly script will return the same transactions as the lxml parser
+    def test_XML_File_STDLIB(self):
+        expected = script.open_xml(script.XML_PATH)
+        lxml = script.LXML
+        script.LXML = None
+        self.addCleanup(setattr, script, 'LXML', lxml)
+        pd.testing.assert_frame_equal(script.open_xml(script.XML_PATH), expected)
+        pd.testing.assert_frame_equal(pd.concat(script.open_xml(script.XML_PATH, chunksize=2), ignore_index=True), expected)
+    # Tests how script finds source files in a directory
+    # if handled correctly script will return every supported file once in sorted order
+    def test_DISCOVER_FILES(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'partner'))
+            for name in ['b.csv', 'a.json', os.path.join('partner', 'c.xml'), 'notes.txt']:
+                open(os.path.join(tmp, name), 'w').close()
+            result = script.discover_files([os.path.join(tmp, '**', '*'), os.path.join(tmp, '*.csv')])
+        self.assertEqual([os.path.relpath(path, tmp) for path in result], ['a.json', 'b.csv', os.path.join('partner', 'c.xml')])
+    # Tests how script opens and standardises several source files in parallel
+    # if handled correctly script will return one standardised dataframe per file in path order
+    def test_LOAD_FILES_PARALLEL(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, source in enumerate([script.JSON_PATH, script.CSV_PATH, script.XML_PATH, script.CSV_PATH]):
+                paths.append(os.path.join(tmp, f'{i}_{os.path.basename(source)}'))
+                shutil.copy(source, paths[-1])
+            result = script.load_files(paths, workers=2)
+        self.assertEqual([len(df) for df in result], [3, 6, 3, 6])
+        self.assertEqual([list(df.columns) for df in result], [script.FRAME_COLUMNS] * 4)
+    # Tests how script handles a source file with the wrong format
+    # if handled correctly script will raise a SourceError naming the file
+    def test_LOAD_FILE_INVALID(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'broken.csv')
+            with open(path, 'w') as f:
+                f.write('a,b\n1,2\n')
+            with self.assertRaises(script.SourceError):
+                script.load_file(path)
+    # Tests how script detects new and changed source files against the manifest
+    # if handled correctly only files that are new or whose content changed are returned
+    def test_CHANGED_FILES(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, name) for name in ['a.csv', 'b.csv']]
+            for path in paths:
+                with open(path, 'w') as f:
+                    f.write('transaction_id\n1\n')
+            changed, manifest = script.changed_files(paths, {})
+            self.assertEqual(changed, paths)
+            self.assertEqual(script.changed_files(paths, manifest)[0], [])
+            with open(paths[1], 'a') as f:
+                f.write('2\n')
+            self.assertEqual(script.changed_files(paths, manifest)[0], [paths[1]])
+    # Tests how script compares files that were removed after they were found
+    # if handled correctly removed files are left out instead of raising an error
+    def test_CHANGED_FILES_MISSING(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.csv')
+            with open(path, 'w') as f:
+                f.write('transaction_id\n1\n')
+            changed, fingerprints = script.changed_files([os.path.join(tmp, 'gone.csv'), path], {})
+        self.assertEqual(changed, [path])
+        self.assertEqual(list(fingerprints), [os.path.abspath(path)])
+    # Tests how script checks transaction ids against the saved id index
+    # if handled correctly saved ids are seen while new and missing ids are not
+    def test_SEEN_IDS(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ids.npy')
+            script.save_seen_ids(np.union1d(script.load_seen_ids(path), script.hash_ids(['S-A-1001', 'ON-2001'])), path)
+            seen = script.load_seen_ids(path)
+        result = script.is_seen(pd.Series(['ON-2001', 'PT-3001', None, 'S-A-1001']), seen)
+        self.assertEqual(list(result), [True, False, False, True])
+    # Tests how script parses timestamps from the different sources into UTC
+    # if handled correctly offsets are applied, timestamps without an offset are UTC and swapped date and time are accepted
+    def test_PARSE_TIMESTAMPS(self):
+        timestamps, date_valid, time_valid = script.parse_timestamps(pd.Series(['2025-08-31T09:12:45+02:00', '2025-08-31T07:14:03Z', '2025-08-31 06:45:00', '06:45:00 2025-08-31']))
+        self.assertEqual(list(timestamps), list(pd.to_datetime(['2025-08-31T07:12:45Z', '2025-08-31T07:14:03Z', '2025-08-31T06:45:00Z', '2025-08-31T06:45:00Z'])))
+        self.assertTrue(date_valid.all())
+        self.assertTrue(time_valid.all())
+    # Tests how script parses invalid timestamps
+    # if handled correctly only the broken part of each timestamp is marked invalid
+    def test_PARSE_TIMESTAMPS_INVALID(self):
+        timestamps, date_valid, time_valid = script.parse_timestamps(pd.Series(['INVALID_DATE', '2025-08-31', '2025-0831 06:45:00', None]))
+        self.assertEqual(list(date_valid), [False, True, False, False])
+        self.assertEqual(list(time_valid), [False, False, True, False])
+        self.assertEqual(timestamps[1], pd.Timestamp('2025-08-31', tz='UTC'))
+
+    # Tests how script converts every standardised source to the same schema
+    # if handled correctly customer ids are integers with missing ids left empty and the merged text fields stay categorical
+    def test_FRAME_SCHEMA(self):
+        frames = [script.normalize_json(script.open_json(script.JSON_PATH)), script.normalize_csv(script.open_csv(script.CSV_PATH)), script.normalize_xml(script.open_xml(script.XML_PATH))]
+        result = script.merge_sources(frames)
+        self.assertEqual(result.dtypes.astype(str).to_dict(), {column: str(pd.Series(dtype=dtype).dtype) for column, dtype in script.FRAME_SCHEMA.items()})
+        self.assertEqual(list(result['customer_id'][:2]), [9001, pd.NA])
+        self.assertEqual(set(result['source_id'].cat.categories), {'online', 'CT-01', 'CT-02', 'CT-03', 'ACME-PARTNER'})
+    # Tests how script renders standardised rows in the output layout
+    # Correct output writes customer ids with their prefix and a missing customer id as 'C--1'
+    def test_RENDER_OUTPUT(self):
+        df = script.enforce_schema(pd.DataFrame({'customer_id': [84219, None], 'transaction_id': ['S-A-1001', 'S-A-1003'],
+                                                 'timestamp': pd.to_datetime(['2025-08-31T07:12:45Z'] * 2), 'date_valid': [True, True], 'time_valid': [True, False],
+                                                 'amount': [1.0, 2.0], 'currency': ['ZAR', 'ZAR'], 'payment_method': ['card', 'card'], 'source_id': ['CT-01', 'CT-02']}))
+        result = script.render_output(df)
+        self.assertEqual(list(result.columns), script.OUTPUT_COLUMNS)
+        self.assertEqual(list(result['customer_id']), ['C-84219', 'C--1'])
+        self.assertEqual(list(result['time'].fillna('')), ['07:12:45+00:00', ''])
+    # Tests how script renders rows whose timestamp could not be fully parsed
+    # Correct output shows the raw timestamp in place of the invalid date and keeps the valid time
+    def test_RENDER_OUTPUT_RAW_TIMESTAMP(self):
+        df = pd.DataFrame({'transaction_id': ['S-A-1001', 'S-A-1002'], 'customer_id': [84219, 84220], 'amount': [1.0, 2.0], 'currency': ['ZAR', 'ZAR'],
+                           'timestamp': ['2025-0831T06:45:00+02:00', '2025-08-31T06:45:00+02:00'], 'payment_method': ['card', 'card'], 'store_id': ['CT-01', 'CT-01']})
+        result = script.render_output(script.normalize_csv(df))
+        self.assertEqual(list(result['date']), ['2025-0831T06:45:00+02:00', '2025-08-31'])
+        self.assertEqual(list(result['time']), ['04:45:00+00:00', '04:45:00+00:00'])
 
     # Tests how flag method handles a invalid customer id
     # Correct output return the "'Invalid Customer ID'" flag
@@ -132,6 +352,429 @@ class TestMain(unittest.TestCase):
         self.assertNotIn('Invalid Currency', result)
         self.assertNotIn('Invalid Payment Method', result)
         self.assertNotIn('Invalid Source ID', result)
+    # Tests that the vectorized flag codes agree with the flag method row by row
+    # Correct output decodes every row's code into the same flags the flag method returns
+    def test_FLAG_CODES_MATCH_FLAG(self):
+        df = pd.DataFrame([
+            {"customer_id" : "C--1", "transaction_id" : "S-A_1001", "date" : "2011-02-04", "time" : r"07:14:03+00:00", "amount" : 300, "currency" : "USD", "payment_method" : "card", "source_id" : "online"},
+            {"customer_id" : "C--1", "transaction_id" : None, "date" : "_", "time" : None, "amount" : -1, "currency" : "USDEUR", "payment_method" : None, "source_id" : None},
+            {"customer_id" : "C-900", "transaction_id" : "S-A_1002", "date" : "2011-02-04", "time" : r"07:14:03+00:00", "amount" : 300, "currency" : "USD", "payment_method" : "card", "source_id" : "online"},
+        ])
+        result = script.decode_flags(script.flag_codes(df))
+        self.assertEqual(result, [script.flag(row) for _, row in df.iterrows()])
+        self.assertEqual(result[1], script.FLAG_REASONS)
+        self.assertEqual(result[2], [])
+    # Tests how flag codes handle a missing amount
+    # Correct output return the "'Invalid Amount'" flag instead of silently dropping the row
+    def test_FLAG_AMOUNT_MISSING(self):
+        row = {"customer_id" : "C-900", "transaction_id" : "S-A_1001", "date" : "2011-02-04", "time" : r"07:14:03+00:00", "amount" : None, "currency" : "USD", "payment_method" : "card", "source_id" : "online"}
+        result = script.flag(row)
+        self.assertIn('Invalid Amount', result)
+
+
+    # Tests how script finds duplicate transactions within the rows being processed
+    # Correct output flags repeated transaction ids and later rows with the same customer, amount and currency close in time
+    def test_DUPLICATES(self):
+        df = duplicate_frame([(1, 'a', '2025-08-31T10:00:00Z', 10.0, 'EUR'), (1, 'b', '2025-08-31T10:01:00Z', 10.0, 'EUR'),
+                              (1, 'c', '2025-08-31T10:10:00Z', 10.0, 'EUR'), (2, 'd', '2025-08-31T10:00:30Z', 10.0, 'EUR'),
+                              (1, 'a', '2025-08-31T12:00:00Z', 5.0, 'USD'), (1, 'e', '2025-08-31T09:59:30Z', 10.0, 'GBP'),
+                              (None, 'f', '2025-08-31T10:00:00Z', 10.0, 'EUR'), (None, 'g', '2025-08-31T10:00:00Z', 10.0, 'EUR')])
+        result = script.DuplicateIndex().check(df, window=120)
+        self.assertEqual(list(result), [False, True, False, False, True, False, False, False])
+    # Tests how script finds duplicates of rows saved by an earlier run
+    # Correct output flags rows close in time to saved rows, before or after them, but not rows that were checked and never saved
+    def test_DUPLICATES_INDEX(self):
+        index = script.DuplicateIndex()
+        index.check(duplicate_frame([(1, 'a', '2025-08-31T10:00:00Z', 10.0, 'EUR')]))
+        index.commit()
+        index.check(duplicate_frame([(3, 'x', '2025-08-31T10:00:00Z', 10.0, 'EUR')]))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.npz')
+            index.save(path)
+            index = script.DuplicateIndex.load(path)
+        df = duplicate_frame([(1, 'b', '2025-08-31T09:59:00Z', 10.0, 'EUR'), (1, 'c', '2025-08-31T10:01:00Z', 10.0, 'EUR'),
+                              (1, 'd', '2025-08-31T11:00:00Z', 10.0, 'EUR'), (3, 'y', '2025-08-31T10:00:00Z', 10.0, 'EUR')])
+        self.assertEqual(list(index.check(df, window=120)), [True, True, False, False])
+    # Tests how the duplicate index drops old rows when rows are dated in the future
+    # Correct output keeps the rows of the last days before the newest plausible row, so a re-ingested transaction is still flagged
+    def test_DUPLICATES_PRUNE(self):
+        index = script.DuplicateIndex()
+        index.check(duplicate_frame([(1, 'a', '2025-08-31T10:00:00Z', 10.0, 'EUR'), (2, 'b', '2099-01-01T10:00:00Z', 10.0, 'EUR'),
+                                     (3, 'c', '2025-07-01T10:00:00Z', 10.0, 'EUR')]))
+        index.commit()
+        index.prune(30)
+        self.assertEqual(len(index.keys), 2)
+        df = duplicate_frame([(1, 'd', '2025-08-31T10:00:00Z', 10.0, 'EUR'), (3, 'e', '2025-07-01T10:00:00Z', 10.0, 'EUR')])
+        self.assertEqual(list(index.check(df)), [True, False])
+    # Tests how the duplicate index handles a transaction id repeated in a later chunk, after saving, and after pruning
+    # Correct output flags the repeated id until its first row is pruned, and loads an index saved without ids
+    def test_DUPLICATES_INDEX_IDS(self):
+        index = script.DuplicateIndex()
+        index.check(duplicate_frame([(1, 'a', '2025-08-31T10:00:00Z', 10.0, 'EUR'), (2, 'b', '2025-07-01T10:00:00Z', 20.0, 'EUR'),
+                                     (3, None, '2025-08-31T10:00:00Z', 30.0, 'EUR')]))
+        index.commit()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.npz')
+            index.save(path, days=None)
+            index = script.DuplicateIndex.load(path)
+            df = duplicate_frame([(4, 'a', '2025-09-01T10:00:00Z', 40.0, 'EUR'), (5, 'b', '2025-09-01T10:00:00Z', 50.0, 'EUR'),
+                                  (6, None, '2025-09-01T10:00:00Z', 60.0, 'EUR'), (7, 'c', '2025-09-01T10:00:00Z', 70.0, 'EUR')])
+            self.assertEqual(list(index.check(df)), [True, True, False, False])
+            index.prune(30)
+            self.assertEqual(list(index.check(df)), [True, False, False, False])
+            np.savez(path, keys=index.keys, times=index.times)
+            self.assertEqual(len(script.DuplicateIndex.load(path).ids), 0)
+    # Tests that the flagged output of a run lists duplicate transactions
+    # Correct output flags the second copy of a transaction loaded twice with the "'Duplicate Transaction'" flag only
+    def test_DUPLICATES_PIPELINE(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = {'xml_path': script.XML_PATH, 'csv_path': script.CSV_PATH, 'json_path': os.path.join(tmp, 'twice.json'),
+                      'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'),
+                      'aggregates_path': os.path.join(tmp, 'aggregates.csv'), 'metrics_dir': None}
+            with open(script.JSON_PATH) as f:
+                records = json.load(f)
+            with open(config['json_path'], 'w') as f:
+                json.dump(records + [dict(records[0], id='ON-9999')], f)
+            script.run_pipeline(config)
+            flagged = pd.read_csv(config['flagged_path'])
+        self.assertEqual(list(flagged.loc[flagged['transaction_id'] == 'ON-9999', 'flags']), ["['Duplicate Transaction']"])
+    # Tests how script merges the daily aggregates of every run into the aggregate store
+    # Correct output adds up counts and sums per key over both runs, keeps the lowest minimum and highest maximum and counts flags per reason
+    def test_AGGREGATES_MERGE(self):
+        df = duplicate_frame([(1, 'a', '2025-08-31T10:00:00Z', 10.0, 'EUR'), (2, 'b', '2025-08-31T23:30:00Z', 20.0, 'EUR'),
+                              (3, 'c', '2025-09-01T00:30:00Z', 30.0, 'EUR')])
+        original = df[['amount', 'currency']].copy()
+        usd = df.assign(amount=df['amount'] * 2, currency='USD')
+        flagged = df.iloc[[0]].assign(flags=np.array([1 | script.DUPLICATE_BIT], dtype=np.uint16))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aggregates.csv')
+            script.save_aggregates(script.daily_aggregates(usd, original, flagged), path)
+            script.save_aggregates(script.daily_aggregates(usd.iloc[[0]].assign(amount=5.0), original.iloc[[0]], flagged.iloc[:0]), path, 'a')
+            result = script.load_aggregates(path).set_index('date')
+        self.assertEqual(list(result.index), ['2025-08-31', '2025-09-01'])
+        self.assertEqual(list(result['clean_count']), [3, 1])
+        self.assertEqual(list(result['amount_sum']), [40.0, 30.0])
+        self.assertEqual(list(result['usd_sum']), [65.0, 60.0])
+        self.assertEqual((result['usd_min'].iloc[0], result['usd_max'].iloc[0]), (5.0, 40.0))
+        self.assertEqual(list(result['flagged_count']), [1, 0])
+        self.assertEqual(list(result['invalid_customer_id']), [1, 0])
+        self.assertEqual(list(result['duplicate_transaction']), [1, 0])
+    # Tests how script answers queries from the aggregate store
+    # Correct output sums the matching rows over the keys left out of by, and a ValueError for unknown keys
+    def test_QUERY_AGGREGATES(self):
+        df = duplicate_frame([(1, 'a', '2025-08-30T10:00:00Z', 10.0, 'EUR'), (2, 'b', '2025-08-31T10:00:00Z', 20.0, 'EUR'),
+                              (3, 'c', '2025-08-31T11:00:00Z', 30.0, 'GBP'), (4, 'd', '2025-09-01T10:00:00Z', 40.0, 'EUR')])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aggregates.csv')
+            script.save_aggregates(script.daily_aggregates(df, df[['amount', 'currency']], df.iloc[:0].assign(flags=np.array([], dtype=np.uint16))), path)
+            by_currency = script.query_aggregates(by=['currency'], start='2025-08-31', path=path)
+            eur = script.query_aggregates(by=['date'], path=path, currency='EUR')
+            with self.assertRaises(ValueError):
+                script.query_aggregates(by=['store'], path=path)
+        self.assertEqual(list(by_currency['currency']), ['EUR', 'GBP'])
+        self.assertEqual(list(by_currency['usd_sum']), [60.0, 30.0])
+        self.assertEqual(list(eur['date']), ['2025-08-30', '2025-08-31', '2025-09-01'])
+        self.assertEqual(list(eur['clean_count']), [1, 1, 1])
+
+    # Tests that the rate provider only fetches rates once and then serves them from the disk cache
+    # Correct output is a single backend request shared by two providers using the same cache directory
+    def test_RATES_CACHED(self):
+        backend = CountingBackend(TEST_RATES)
+        with tempfile.TemporaryDirectory() as tmp:
+            first = script.RateProvider(backend, cache_dir=tmp).get('USD')
+            second = script.RateProvider(backend, cache_dir=tmp).get('USD')
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(first, second)
+    # Tests that the latest rates are refetched once the cached copy is older than the TTL
+    # Correct output is a second backend request
+    def test_RATES_CACHE_EXPIRED(self):
+        backend = CountingBackend(TEST_RATES)
+        with tempfile.TemporaryDirectory() as tmp:
+            script.RateProvider(backend, cache_dir=tmp, ttl=0).get('USD')
+            script.RateProvider(backend, cache_dir=tmp, ttl=0).get('USD')
+        self.assertEqual(backend.calls, 2)
+    # Tests that a stale cached copy is used when the backend fails
+    # Correct output returns the cached rates instead of raising an error
+    def test_RATES_STALE_FALLBACK(self):
+        backend = CountingBackend(TEST_RATES)
+        with tempfile.TemporaryDirectory() as tmp:
+            script.RateProvider(backend, cache_dir=tmp, ttl=0).get('USD')
+            backend.fail = True
+            result = script.RateProvider(backend, cache_dir=tmp, ttl=0).get('USD')
+        self.assertEqual(result['rates'], TEST_RATES)
+    # Tests how the rate provider handles a failing backend without any cached rates
+    # if handled correctly the provider raises a RateError
+    def test_RATES_UNAVAILABLE(self):
+        backend = CountingBackend(TEST_RATES)
+        backend.fail = True
+        with self.assertRaises(script.RateError):
+            script.RateProvider(backend, cache_dir=None).get('USD')
+    # Tests which failed responses the frankfurter backend retries
+    # Correct output retries 429 and 5xx responses until one succeeds, and raises a RateError after a single 404 request
+    def test_RATES_RETRY_STATUS(self):
+        backend = script.FrankfurterBackend(attempts=3, backoff=0)
+        backend.session = StatusSession([429, 503, 200])
+        self.assertEqual(backend.fetch('USD')['rates'], TEST_RATES)
+        self.assertEqual(backend.session.calls, 3)
+        backend.session = StatusSession([404])
+        with self.assertRaises(script.RateError):
+            backend.fetch('USD', '1970-01-01')
+        self.assertEqual(backend.session.calls, 1)
+    # Tests that historical rates for many dates are fetched with a single time series request
+    # Correct output uses the rates of the closest earlier working day for a weekend date
+    def test_RATES_HISTORY_BATCHED(self):
+        backend = SeriesBackend({'2025-08-28': {'ZAR': 17.0}, '2025-08-29': {'ZAR': 18.0}, '2025-09-01': {'ZAR': 19.0}})
+        provider = script.RateProvider(backend, cache_dir=None)
+        table = provider.get_history('USD', ['2025-08-29', '2025-08-31', '2025-09-01', '2025-08-29'])
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(list(table['ZAR']), [18.0, 18.0, 19.0])
+        provider.get_history('USD', ['2025-08-31'])
+        self.assertEqual(backend.calls, 1)
+    # Tests how historical rates handle dates the API has no rates for and failing time series requests
+    # Correct output leaves those dates out of the table without any single date requests, so their rows use the latest rate
+    def test_RATES_HISTORY_MISSING(self):
+        backend = SeriesBackend({'2025-08-29': {'ZAR': 10.0}})
+        provider = script.RateProvider(backend, cache_dir=None)
+        table = provider.get_history('USD', ['1970-01-01', '2025-08-31'])
+        backend.fail = True
+        failed = script.RateProvider(backend, cache_dir=None).get_history('USD', ['2025-08-31'])
+        rates = script.lookup_rates(pd.to_datetime(['1970-01-01T10:00:00Z', '2025-08-31T10:00:00Z']), ['ZAR', 'ZAR'], provider)
+        self.assertEqual(list(table.index), ['2025-08-31'])
+        self.assertEqual(len(failed), 0)
+        self.assertEqual(backend.calls, 4)
+        self.assertEqual(list(rates), [10.0, 10.0])
+    # Tests that rates cached for a date before its rates were published are fetched again the next day
+    # Correct output uses the earlier day's rates on the day itself and the published rates once the day has ended
+    def test_RATES_HISTORY_UNPUBLISHED(self):
+        backend = SeriesBackend({'2025-08-28': {'ZAR': 17.0}})
+        provider = script.RateProvider(backend, cache_dir=None)
+        clock = script.time.time
+        try:
+            script.time.time = lambda: datetime.datetime(2025, 8, 29, 10, tzinfo=datetime.timezone.utc).timestamp()
+            today = provider.get_history('USD', ['2025-08-29'])
+            backend.series['2025-08-29'] = {'ZAR': 18.0}
+            script.time.time = lambda: datetime.datetime(2025, 8, 30, 10, tzinfo=datetime.timezone.utc).timestamp()
+            tomorrow = provider.get_history('USD', ['2025-08-29'])
+            again = provider.get_history('USD', ['2025-08-29'])
+        finally:
+            script.time.time = clock
+        self.assertEqual((today['ZAR'].iloc[0], tomorrow['ZAR'].iloc[0], again['ZAR'].iloc[0]), (17.0, 18.0, 18.0))
+        self.assertEqual(backend.calls, 2)
+    # Tests that amounts are converted at the rate for each transaction's own date
+    # Correct output divides every amount by the rate of its date and leaves USD amounts unchanged
+    def test_CONVERT_HISTORICAL(self):
+        backend = SeriesBackend({'2024-01-02': {'ZAR': 20.0}, '2025-08-29': {'ZAR': 10.0}})
+        df = pd.DataFrame({'timestamp': pd.to_datetime(['2024-01-02T10:00:00Z', '2025-08-31T23:00:00Z', '2025-08-31T01:00:00Z']), 'amount': [100.0, 100.0, 5.0], 'currency': ['ZAR', 'ZAR', 'USD']})
+        result = script.convert_to_usd(df, script.RateProvider(backend, cache_dir=None))
+        self.assertEqual(list(result['amount']), [5.0, 10.0, 5.0])
+        self.assertEqual(list(result['currency']), ['USD'] * 3)
+
+    # Tests how run metrics add up stages that run more than once and count flags per reason
+    # Correct output saves a JSON file with the totals of every stage and the number of rows flagged for each reason
+    def test_RUN_METRICS(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics = script.RunMetrics('batch', metrics_dir=tmp, profile_stage='flag')
+            for rows in [2, 3]:
+                with metrics.stage('load') as record:
+                    record['rows_out'] = rows
+            with metrics.stage('flag', 3) as record:
+                record['rows_out'] = metrics.count_flags(np.array([0, 1 | 16, 16], dtype=np.uint16))
+            with open(metrics.save()) as f:
+                result = json.load(f)
+            profiles = [name for name in os.listdir(tmp) if name.startswith('profile_flag_')]
+        self.assertEqual(result['stages']['load']['calls'], 2)
+        self.assertEqual(result['stages']['load']['rows_out'], 5)
+        self.assertEqual(result['stages']['flag']['rows_out'], 2)
+        self.assertEqual(result['flags']['Invalid Customer ID'], 1)
+        self.assertEqual(result['flags']['Invalid Amount'], 2)
+        self.assertEqual(len(profiles), 1)
+
+    # Tests how script runs the whole cleaning process in the current process
+    # Correct output saves every record to the clean or flagged file given in the settings and returns the run metrics
+    def test_RUN_PIPELINE(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = {'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'),
+                      'aggregates_path': os.path.join(tmp, 'aggregates.csv'), 'metrics_dir': None}
+            metrics = script.run_pipeline(config)
+            stream = script.run_pipeline({**config, 'stream_flag': True, 'chunk_size': 2})
+            clean, flagged = pd.read_csv(config['clean_path']), pd.read_csv(config['flagged_path'])
+            totals = script.query_aggregates(by=[], path=config['aggregates_path'])
+        self.assertEqual(metrics.rows, {'clean': 6, 'flagged': 6})
+        self.assertEqual(stream.rows, metrics.rows)
+        self.assertEqual((len(clean), len(flagged)), (6, 6))
+        self.assertEqual((totals['clean_count'].iloc[0], totals['flagged_count'].iloc[0]), (6, 6))
+        self.assertAlmostEqual(totals['usd_sum'].iloc[0], clean['amount'].sum())
+    # Tests how script uses the rate provider given in the settings of a run
+    # Correct output fetches every rate from that provider and converts at its latest rates when historical rates are turned off
+    def test_RUN_PIPELINE_RATE_PROVIDER(self):
+        backend = CountingBackend({'ZAR': 10.0})
+        with tempfile.TemporaryDirectory() as tmp:
+            config = {'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'), 'aggregates_path': None,
+                      'metrics_dir': None, 'rate_provider': script.RateProvider(backend, cache_dir=None), 'historical_rates_flag': False}
+            script.run_pipeline(config)
+            clean = pd.read_csv(config['clean_path'])
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(list(clean.loc[clean['transaction_id'] == 'S-A-1002', 'amount']), [7.95])
+    # Tests how script handles a failing run and unknown settings
+    # if handled correctly script raises a PipelineError after saving the failed metrics, and a ValueError for unknown settings
+    def test_RUN_PIPELINE_FAILED(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(script.PipelineError):
+                script.run_pipeline({'json_path': '', 'metrics_dir': tmp})
+            with open(os.path.join(tmp, os.listdir(tmp)[0])) as f:
+                self.assertEqual(json.load(f)['status'], 'failed')
+        with self.assertRaises(ValueError):
+            script.run_pipeline({'json_paths': script.JSON_PATH})
+    # Tests how script processes source files as they arrive in watch mode
+    # Correct output saves the rows of every file once, including a file that arrives while it is running, and stops when asked
+    def test_RUN_WATCH(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'data'))
+            shutil.copy(script.CSV_PATH, os.path.join(tmp, 'data', 'a.csv'))
+            config = {**script.default_config(), 'source_globs': [os.path.join(tmp, 'data', '*')], 'workers': 1, 'metrics_dir': None,
+                      'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'),
+                      'aggregates_path': os.path.join(tmp, 'aggregates.csv'), 'manifest_path': os.path.join(tmp, 'manifest.json'), 'seen_ids_path': os.path.join(tmp, 'ids.npy'),
+                      'watch_interval': 0.02, 'watch_batch_seconds': 0.05}
+            stop = script.threading.Event()
+            batches = []
+            watcher = script.threading.Thread(target=lambda: batches.append(script.run_watch(config, stop)))
+            watcher.start()
+            # Waits until the saved manifest lists every file in the data directory
+            def wait_for(count):
+                for _ in range(200):
+                    if len(script.load_manifest(config['manifest_path'])) == count:
+                        return
+                    script.time.sleep(0.02)
+            wait_for(1)
+            shutil.copy(script.XML_PATH, os.path.join(tmp, 'data', 'b.xml'))
+            wait_for(2)
+            stop.set()
+            watcher.join(5)
+            rows = len(pd.read_csv(config['clean_path'])) + len(pd.read_csv(config['flagged_path']))
+        self.assertFalse(watcher.is_alive())
+        self.assertEqual(batches, [2])
+        self.assertEqual(rows, 9)
+    # Tests how incremental runs recover from a run that stopped after appending its rows but before saving its state
+    # Correct output undoes the appended rows and daily totals when the manifest was not saved, and otherwise only adds the missing saved ids,
+    # so every row is saved exactly once
+    def test_RUN_INCREMENTAL_RECOVER(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'data'))
+            shutil.copy(script.CSV_PATH, os.path.join(tmp, 'data', 'a.csv'))
+            config = {'incremental_flag': True, 'source_globs': [os.path.join(tmp, 'data', '*')], 'workers': 1, 'metrics_dir': None,
+                      'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'),
+                      'aggregates_path': os.path.join(tmp, 'aggregates.csv'), 'manifest_path': os.path.join(tmp, 'manifest.json'),
+                      'seen_ids_path': os.path.join(tmp, 'ids.npy')}
+            script.run_pipeline(config)
+            shutil.copy(script.XML_PATH, os.path.join(tmp, 'data', 'b.xml'))
+            for name in ['save_manifest', 'save_seen_ids']:
+                save = getattr(script, name)
+                setattr(script, name, lambda *args: 1 / 0)
+                try:
+                    with self.assertRaises(script.PipelineError):
+                        script.run_pipeline(config)
+                finally:
+                    setattr(script, name, save)
+                script.run_pipeline(config)
+                rows = len(pd.read_csv(config['clean_path'])) + len(pd.read_csv(config['flagged_path']))
+                totals = script.query_aggregates(by=[], path=config['aggregates_path'])
+                self.assertEqual(rows, 9)
+                self.assertEqual(totals['clean_count'].iloc[0] + totals['flagged_count'].iloc[0], 9)
+                self.assertEqual(len(script.load_seen_ids(config['seen_ids_path'])), 9)
+                self.assertFalse(os.path.exists(script.pending_path(config)))
+                os.remove(config['manifest_path'])
+                os.remove(config['seen_ids_path'])
+                os.remove(os.path.join(tmp, 'data', 'b.xml'))
+                script.run_pipeline(config)
+                shutil.copy(script.XML_PATH, os.path.join(tmp, 'data', 'b.xml'))
+    # Tests how watch mode handles a batch that fails
+    # Correct output queues the files of the failed batch again and saves their rows once the next batch succeeds
+    def test_RUN_WATCH_RETRY(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'data'))
+            shutil.copy(script.CSV_PATH, os.path.join(tmp, 'data', 'a.csv'))
+            config = {**script.default_config(), 'source_globs': [os.path.join(tmp, 'data', '*')], 'workers': 1, 'metrics_dir': None,
+                      'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'),
+                      'aggregates_path': os.path.join(tmp, 'aggregates.csv'), 'manifest_path': os.path.join(tmp, 'manifest.json'),
+                      'seen_ids_path': os.path.join(tmp, 'ids.npy'), 'watch_interval': 0.02, 'watch_batch_seconds': 0.05}
+            process_files, failures = script.process_files, []
+            # Fails the first batch only
+            def fail_once(*args):
+                if not failures:
+                    failures.append(args[0])
+                    raise script.PipelineError('Failed once')
+                return process_files(*args)
+            script.process_files = fail_once
+            stop = script.threading.Event()
+            try:
+                watcher = script.threading.Thread(target=script.run_watch, args=(config, stop))
+                watcher.start()
+                for _ in range(200):
+                    if script.load_manifest(config['manifest_path']):
+                        break
+                    script.time.sleep(0.02)
+                stop.set()
+                watcher.join(5)
+            finally:
+                script.process_files = process_files
+            rows = len(pd.read_csv(config['clean_path'])) + len(pd.read_csv(config['flagged_path']))
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(rows, len(pd.read_csv(script.CSV_PATH)))
+    # Tests how watch mode handles a source file with the wrong layout next to a valid file
+    # Correct output saves the rows of the valid file and records the bad file as failed so it is not tried again until it changes
+    def test_RUN_WATCH_BAD_FILE(self):
+        for files in [['a.csv', 'bad.csv'], ['bad.csv']]:
+            with tempfile.TemporaryDirectory() as tmp:
+                os.makedirs(os.path.join(tmp, 'data'))
+                with open(os.path.join(tmp, 'data', 'bad.csv'), 'w') as f:
+                    f.write('wrong,columns\n1,2\n')
+                if 'a.csv' in files:
+                    shutil.copy(script.CSV_PATH, os.path.join(tmp, 'data', 'a.csv'))
+                config = {**script.default_config(), 'source_globs': [os.path.join(tmp, 'data', '*')], 'workers': 1, 'metrics_dir': None,
+                          'clean_path': os.path.join(tmp, 'clean.csv'), 'flagged_path': os.path.join(tmp, 'flagged.csv'),
+                          'aggregates_path': os.path.join(tmp, 'aggregates.csv'), 'manifest_path': os.path.join(tmp, 'manifest.json'),
+                          'seen_ids_path': os.path.join(tmp, 'ids.npy'), 'watch_interval': 0.02, 'watch_batch_seconds': 0.05}
+                stop = script.threading.Event()
+                batches = []
+                watcher = script.threading.Thread(target=lambda: batches.append(script.run_watch(config, stop)))
+                watcher.start()
+                for _ in range(200):
+                    if len(script.load_manifest(config['manifest_path'])) == len(files):
+                        break
+                    script.time.sleep(0.02)
+                script.time.sleep(0.2)
+                stop.set()
+                watcher.join(5)
+                manifest = script.load_manifest(config['manifest_path'])
+                rows = len(pd.read_csv(config['clean_path'])) + len(pd.read_csv(config['flagged_path']))
+            self.assertEqual(rows, len(pd.read_csv(script.CSV_PATH)) if 'a.csv' in files else 0)
+            self.assertEqual([entry.get('failed', False) for path, entry in sorted(manifest.items())], [name == 'bad.csv' for name in files])
+            self.assertEqual(batches, [1])
+    # Tests how script collects queued files into micro-batches
+    # Correct output closes a batch at its size limit and returns the queued files straight away once stopped
+    def test_NEXT_BATCH(self):
+        files = script.queue.Queue()
+        for name in 'abc':
+            files.put(name)
+        stop = script.threading.Event()
+        self.assertEqual(script.next_batch(files, stop, 2, 10), ['a', 'b'])
+        stop.set()
+        self.assertEqual(script.next_batch(files, stop, 2, 10), ['c'])
+        self.assertEqual(script.next_batch(files, stop, 2, 10), [])
+    # Tests how script reads its settings from the command line
+    # Correct output only holds the settings that were given
+    def test_PARSE_ARGS(self):
+        config = script.parse_args(['--json', 'a.json', '--stream', '--print', 'final', '--no-metrics'])
+        self.assertEqual(config, {'json_path': 'a.json', 'stream_flag': True, 'final_print_flag': True, 'metrics_dir': None})
+        self.assertEqual(script.parse_args([]), {})
+        self.assertEqual(script.parse_args(['--duplicate-window', '60', '--duplicate-index', '--duplicate-index-days', '7']),
+                         {'duplicate_window': 60.0, 'duplicate_index_flag': True, 'duplicate_index_days': 7})
+    # Tests that importing script does not import requests
+    # if handled correctly requests is only imported once exchange rates are fetched from the API
+    def test_IMPORT_LAZY(self):
+        code = 'import sys; from src import script; print("requests" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code], cwd=parent_dir, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
 
 if __name__ == "__main__":
     unittest.main()